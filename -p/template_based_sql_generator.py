@@ -4,17 +4,75 @@ Template-based SQL generator as fallback when LLM fails.
 Replace the generate_sql_node in graph_hybrid.py to use this instead of relying on broken LLM.
 """
 import re
+import sys
+from functools import lru_cache
 from typing import Dict, Optional
 
+# Precompiled patterns (avoid re-parsing / cache lookups on every call)
+_START_DATE_RE = re.compile(r'START_DATE:(\d{4}-\d{2}-\d{2})')
+_END_DATE_RE = re.compile(r'END_DATE:(\d{4}-\d{2}-\d{2})')
+_CATEGORY_RE = re.compile(r'CATEGORY:([^|]+)')
+_YEAR_RE = re.compile(r'(20\d{2})')
+_MD_RE = re.compile(r'```(?:sql)?\n?')
+_SELECT_RE = re.compile(r'SELECT', re.IGNORECASE)
+_FROM_RE = re.compile(r'FROM', re.IGNORECASE)
+_WHERE_RE = re.compile(r'WHERE', re.IGNORECASE)
+_BETWEEN_TYPOS_RE = re.compile(r'BETWEWHEN|BETWEWEN|BETWEN|BEWTEEN')
+_TRIPLE_QUOTES_RE = re.compile(r'"""|\'\'\'')
+_QUOTED_COL_RE = re.compile(r'"([a-z])"\.')
+_ORDER_DETAILS_RE = re.compile(r'\bOrder\s+Details\b', re.IGNORECASE)
+_ORDER_DETAILS_QUOTED_RE = re.compile(r'["\']Order\s+Details["\']', re.IGNORECASE)
+_COMMENT_RE = re.compile(r'--[^\n]*')
+_ORDERDATE_UNIFIED_RE = re.compile(
+    r'\b(?<!date\()(?:(\w+)\.)?OrderDate\s+(BETWEEN|>=|<=|>|<|=)',
+    re.IGNORECASE
+)
+_DATE_TAG_RE = re.compile(r'(?:START|END)_DATE:')
+_DATE_BETWEEN_RE = re.compile(
+    r"date\([^)]+\.OrderDate\)\s+BETWEEN\s+'[^']+'\s+AND\s+'[^']+'",
+    re.IGNORECASE
+)
+
+# Trigger keywords for template dispatch, found in one scan. The lookahead keeps
+# overlapping hits so membership matches plain `kw in question_lower`. Keywords
+# are interned (multi-word literals are not interned automatically) so lookups
+# against the rule table hit the identity fast path.
+_TEMPLATE_KEYWORDS = tuple(map(sys.intern, (
+    'category', 'quantity', 'highest', 'aov', 'average order value',
+    'top 3 products', 'all-time', 'revenue', 'customer', 'margin',
+)))
+_KEYWORDS_RE = re.compile('(?=(' + '|'.join(re.escape(kw) for kw in _TEMPLATE_KEYWORDS) + '))')
+
+
+def _keyword_set(*keywords: str) -> frozenset:
+    """Frozenset of interned keywords for the template rule table."""
+    return frozenset(map(sys.intern, keywords))
+
+
+# All-time query has no parameters, so it is built exactly once
+_TOP3_SQL = """SELECT p.ProductName, ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
+FROM "Order Details" od
+JOIN Products p ON od.ProductID = p.ProductID
+GROUP BY p.ProductName
+ORDER BY Revenue DESC
+LIMIT 3"""
+
 
 class TemplateSQLGenerator:
     """Generate SQL from templates instead of unreliable LLM."""
     
+    # Category names, their lower-cased lookup map and one alternation to find
+    # them, all built once at class definition time
+    _CATEGORY_NAMES = ('Beverages', 'Condiments', 'Confections', 'Dairy Products',
+                       'Grains/Cereals', 'Meat/Poultry', 'Produce', 'Seafood')
+    _CATEGORY_LC_MAP = {name.lower(): name for name in _CATEGORY_NAMES}
+    _CATEGORY_ALT_RE = re.compile('|'.join(re.escape(lc) for lc in _CATEGORY_LC_MAP))
+    
     @staticmethod
     def extract_dates(constraints: str) -> tuple:
         """Extract first date range from constraints."""
-        start = re.search(r'START_DATE:(\d{4}-\d{2}-\d{2})', constraints)
-        end = re.search(r'END_DATE:(\d{4}-\d{2}-\d{2})', constraints)
+        start = _START_DATE_RE.search(constraints)
+        end = _END_DATE_RE.search(constraints)
         
         if start and end:
             return start.group(1), end.group(1)
@@ -23,10 +81,17 @@ class TemplateSQLGenerator:
     @staticmethod
     def extract_categories(constraints: str) -> list:
         """Extract category names."""
-        categories = re.findall(r'CATEGORY:([^|]+)', constraints)
+        categories = _CATEGORY_RE.findall(constraints)
         return [c.strip() for c in categories]
     
     @staticmethod
+    def extract_first_category(constraints: str) -> Optional[str]:
+        """Extract only the first category name (stops at the first match)."""
+        match = _CATEGORY_RE.search(constraints)
+        return match.group(1).strip() if match else None
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
     def generate_category_quantity_query(start_date: str, end_date: str) -> str:
         """Template: Top category by quantity in date range."""
         return f"""SELECT c.CategoryName, SUM(od.Quantity) as TotalQuantity
@@ -40,6 +105,7 @@ ORDER BY TotalQuantity DESC
 LIMIT 1"""
     
     @staticmethod
+    @lru_cache(maxsize=128)
     def generate_aov_query(start_date: str, end_date: str) -> str:
         """Template: Average Order Value in date range."""
         return f"""SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID), 2) as AOV
@@ -50,14 +116,10 @@ WHERE date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'"""
     @staticmethod
     def generate_top_products_revenue_query() -> str:
         """Template: Top 3 products by revenue (all-time)."""
-        return """SELECT p.ProductName, ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
-FROM "Order Details" od
-JOIN Products p ON od.ProductID = p.ProductID
-GROUP BY p.ProductName
-ORDER BY Revenue DESC
-LIMIT 3"""
+        return _TOP3_SQL
     
     @staticmethod
+    @lru_cache(maxsize=128)
     def generate_category_revenue_query(category: str, start_date: str, end_date: str) -> str:
         """Template: Revenue for specific category in date range."""
         return f"""SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
@@ -69,6 +131,7 @@ WHERE c.CategoryName = '{category}'
   AND date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'"""
     
     @staticmethod
+    @lru_cache(maxsize=128)
     def generate_customer_margin_query(year: str) -> str:
         """Template: Top customer by gross margin in year."""
         return f"""SELECT c.CompanyName, ROUND(SUM((od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount)), 2) as GrossMargin
@@ -80,6 +143,40 @@ GROUP BY c.CompanyName
 ORDER BY GrossMargin DESC
 LIMIT 1"""
     
+    # Dispatch table, tried in priority order:
+    # (required keywords, needs date range, extra argument source, builder name).
+    # The extra argument is only extracted once the cheaper checks have passed.
+    _RULES = (
+        # Pattern 1: Top category by quantity
+        (_keyword_set('category', 'quantity', 'highest'), True, None, 'generate_category_quantity_query'),
+        # Pattern 2: Average Order Value (AOV)
+        (_keyword_set('aov'), True, None, 'generate_aov_query'),
+        (_keyword_set('average order value'), True, None, 'generate_aov_query'),
+        # Pattern 3: Top 3 products by revenue (all-time)
+        (_keyword_set('top 3 products', 'revenue', 'all-time'), False, None, 'generate_top_products_revenue_query'),
+        # Pattern 4: Category revenue in date range (category from constraints)
+        (_keyword_set('revenue', 'category'), True, 'constraint_category', 'generate_category_revenue_query'),
+        # Pattern 5: Revenue from specific category (e.g., "Beverages revenue")
+        (_keyword_set('revenue'), True, 'question_category', 'generate_category_revenue_query'),
+        # Pattern 6: Customer by margin (year from question)
+        (_keyword_set('customer', 'margin'), False, 'year', 'generate_customer_margin_query'),
+    )
+    
+    @classmethod
+    def _rule_argument(cls, source: str, question: str, question_lower: str, constraints: str) -> Optional[str]:
+        """Extract the extra template argument named by a dispatch rule."""
+        if source == 'constraint_category':
+            # Use first category (usually the relevant one)
+            return cls.extract_first_category(constraints)
+        if source == 'question_category':
+            # Check for category name in question (first mention wins)
+            cat_match = cls._CATEGORY_ALT_RE.search(question_lower)
+            return cls._CATEGORY_LC_MAP[cat_match.group(0)] if cat_match else None
+        if source == 'year':
+            year_match = _YEAR_RE.search(question)
+            return year_match.group(1) if year_match else None
+        return None
+    
     @classmethod
     def generate_from_question(cls, question: str, constraints: str) -> Optional[str]:
         """
@@ -87,47 +184,24 @@ LIMIT 1"""
         Returns None if no template matches.
         """
         question_lower = question.lower()
+        hits = frozenset(map(sys.intern, _KEYWORDS_RE.findall(question_lower)))
         
         # Extract dates
         start_date, end_date = cls.extract_dates(constraints)
+        has_dates = bool(start_date and end_date)
         
-        # Pattern 1: Top category by quantity
-        if 'category' in question_lower and 'quantity' in question_lower and 'highest' in question_lower:
-            if start_date and end_date:
-                return cls.generate_category_quantity_query(start_date, end_date)
-        
-        # Pattern 2: Average Order Value (AOV)
-        if 'aov' in question_lower or 'average order value' in question_lower:
-            if start_date and end_date:
-                return cls.generate_aov_query(start_date, end_date)
-        
-        # Pattern 3: Top 3 products by revenue (all-time)
-        if 'top 3 products' in question_lower and 'revenue' in question_lower and 'all-time' in question_lower:
-            return cls.generate_top_products_revenue_query()
-        
-        # Pattern 4: Category revenue in date range
-        if 'revenue' in question_lower and 'category' in question_lower:
-            categories = cls.extract_categories(constraints)
-            if categories and start_date and end_date:
-                # Use first category (usually the relevant one)
-                return cls.generate_category_revenue_query(categories[0], start_date, end_date)
-        
-        # Pattern 5: Revenue from specific category (e.g., "Beverages revenue")
-        if 'revenue' in question_lower:
-            # Check for category name in question
-            category_names = ['Beverages', 'Condiments', 'Confections', 'Dairy Products', 
-                            'Grains/Cereals', 'Meat/Poultry', 'Produce', 'Seafood']
-            for cat in category_names:
-                if cat.lower() in question_lower:
-                    if start_date and end_date:
-                        return cls.generate_category_revenue_query(cat, start_date, end_date)
-        
-        # Pattern 6: Customer by margin
-        if 'customer' in question_lower and 'margin' in question_lower:
-            # Extract year from question or constraints
-            year_match = re.search(r'(20\d{2})', question)
-            if year_match:
-                return cls.generate_customer_margin_query(year_match.group(1))
+        for required, needs_dates, arg_source, builder in cls._RULES:
+            if not required <= hits or (needs_dates and not has_dates):
+                continue
+            
+            args = (start_date, end_date) if needs_dates else ()
+            if arg_source:
+                value = cls._rule_argument(arg_source, question, question_lower, constraints)
+                if value is None:
+                    continue
+                args = (value, *args)
+            
+            return getattr(cls, builder)(*args)
         
         return None
 
@@ -138,47 +212,46 @@ def generate_sql_node_with_templates(self, state):
     
     Uses template-based generation with LLM as fallback.
     """
-    question_lower = state['question'].lower()
+    question = state['question']
+    trace = state['trace']
+    question_lower = question.lower()
     all_constraints = state.get('constraints', '').split(' | ')
     
-    # Filter to relevant date range
-    filtered_constraints = []
-    
+    # Filter to relevant date range: pick the wanted campaign dates once,
+    # then keep non-date constraints plus the matching (or first) date
     if 'summer' in question_lower and '2017' in question_lower:
-        for c in all_constraints:
-            if 'START_DATE:2017-06-01' in c or 'END_DATE:2017-06-30' in c:
-                filtered_constraints.append(c)
-            elif 'START_DATE:' not in c and 'END_DATE:' not in c:
-                filtered_constraints.append(c)
+        wanted = ('START_DATE:2017-06-01', 'END_DATE:2017-06-30')
     elif 'winter' in question_lower and '2017' in question_lower:
-        for c in all_constraints:
-            if 'START_DATE:2017-12-01' in c or 'END_DATE:2017-12-31' in c:
-                filtered_constraints.append(c)
-            elif 'START_DATE:' not in c and 'END_DATE:' not in c:
-                filtered_constraints.append(c)
+        wanted = ('START_DATE:2017-12-01', 'END_DATE:2017-12-31')
     else:
-        # First date range only
-        seen_date = False
-        for c in all_constraints:
-            if 'START_DATE:' in c or 'END_DATE:' in c:
-                if not seen_date:
-                    filtered_constraints.append(c)
-                    seen_date = True
-            else:
+        wanted = None
+    
+    filtered_constraints = []
+    seen_date = False
+    for c in all_constraints:
+        if not _DATE_TAG_RE.search(c):
+            filtered_constraints.append(c)
+        elif wanted is None:
+            # First date range only
+            if not seen_date:
                 filtered_constraints.append(c)
+                seen_date = True
+        elif wanted[0] in c or wanted[1] in c:
+            filtered_constraints.append(c)
     
     enhanced_constraints = ' | '.join(filtered_constraints)
     self._current_constraints = enhanced_constraints
+    # Parsed once here so the SQL cleaner does not have to re-scan the constraints
+    self._current_date_range = TemplateSQLGenerator.extract_dates(enhanced_constraints)
     
     self._log(f"Constraints: {enhanced_constraints[:200]}...")
     
     # TRY TEMPLATE FIRST
-    sql = TemplateSQLGenerator.generate_from_question(state['question'], enhanced_constraints)
+    sql = TemplateSQLGenerator.generate_from_question(question, enhanced_constraints)
     
     if sql:
         self._log("Using TEMPLATE-generated SQL")
-        state['sql'] = sql
-        state['trace'].append("Generated SQL (template)")
+        trace.append("Generated SQL (template)")
     else:
         # Fallback to LLM
         self._log("No template match, using LLM")
@@ -191,108 +264,96 @@ def generate_sql_node_with_templates(self, state):
             "CRITICAL: JOIN Orders o ON od.OrderID = o.OrderID"
         ]
         
-        enhanced_constraints += " | " + " | ".join(hints)
+        enhanced_constraints = ' | '.join([enhanced_constraints, *hints])
         
         sql = self.sql_gen(
-            question=state['question'],
+            question=question,
             schema=schema,
             constraints=enhanced_constraints
         )
         
         # Aggressive cleaning
         sql = self._clean_sql_aggressive(sql)
-        
-        state['sql'] = sql
-        state['trace'].append("Generated SQL (LLM + cleaned)")
+        trace.append("Generated SQL (LLM + cleaned)")
     
+    state['sql'] = sql
     self._log(f"Final SQL:\n{sql}")
     
     return state
 
 
+def _wrap_order_date(match) -> str:
+    """Replacement for _ORDERDATE_UNIFIED_RE: wrap the column in date(), keeping the alias."""
+    alias, op = match.group(1), match.group(2)
+    column = f"{alias}.OrderDate" if alias else "OrderDate"
+    return f"date({column}) {op}"
+
+
 def _clean_sql_aggressive(self, sql: str) -> str:
     """
     ULTRA-AGGRESSIVE SQL cleaning for broken LLM output.
+    
+    Passes anchored on a literal token are skipped when the token is absent,
+    so already-clean SQL only pays for the case-insensitive fixes.
     """
     # Remove markdown
-    sql = re.sub(r'```(?:sql)?\n?', '', sql)
+    if '```' in sql:
+        sql = _MD_RE.sub('', sql)
     sql = sql.strip()
     
     # Extract SELECT if buried
-    if 'SELECT' in sql.upper():
-        sql = sql[sql.upper().find('SELECT'):]
+    select_match = _SELECT_RE.search(sql)
+    if select_match:
+        sql = sql[select_match.start():]
     
-    # Fix all known typos
-    sql = sql.replace('BETWEWHEN', 'BETWEEN')
-    sql = sql.replace('BETWEWEN', 'BETWEEN')
-    sql = sql.replace('BETWEN', 'BETWEEN')
-    sql = sql.replace('BEWTEEN', 'BETWEEN')
+    # Fix all known typos (single pass)
+    sql = _BETWEEN_TYPOS_RE.sub('BETWEEN', sql)
     
-    # Fix quotes - TRIPLE QUOTES to DOUBLE
-    sql = sql.replace('"""', '"')
-    sql = sql.replace("'''", "'")
+    # Fix quotes - TRIPLE QUOTES to single character of the same kind
+    sql = _TRIPLE_QUOTES_RE.sub(lambda m: m.group(0)[0], sql)
     
     # Fix "o".OrderDate -> o.OrderDate
-    sql = re.sub(r'"([a-z])"\.', r'\1.', sql)
+    if '".' in sql:
+        sql = _QUOTED_COL_RE.sub(r'\1.', sql)
     
     # Fix Order Details
-    sql = re.sub(r'\bOrder\s+Details\b', '"Order Details"', sql, flags=re.IGNORECASE)
-    sql = re.sub(r'["\']Order\s+Details["\']', '"Order Details"', sql, flags=re.IGNORECASE)
+    sql = _ORDER_DETAILS_RE.sub('"Order Details"', sql)
+    sql = _ORDER_DETAILS_QUOTED_RE.sub('"Order Details"', sql)
     
     # Remove SQL comments (they often contain errors)
-    sql = re.sub(r'--[^\n]*', '', sql)
+    if '--' in sql:
+        sql = _COMMENT_RE.sub('', sql)
     
     # Fix missing FROM
-    if 'SELECT' in sql.upper() and 'FROM' not in sql.upper():
+    select_match = _SELECT_RE.search(sql)
+    if select_match and not _FROM_RE.search(sql):
         # SQL is truncated, try to recover
         if '"Order Details"' in sql:
             # Add minimal FROM clause
-            select_pos = sql.upper().find('SELECT')
-            sql = sql[:select_pos] + 'SELECT * FROM "Order Details" od'
+            sql = sql[:select_match.start()] + 'SELECT * FROM "Order Details" od'
     
     # Add missing Orders JOIN if needed
     if 'o.OrderDate' in sql and 'JOIN Orders' not in sql:
-        if 'WHERE' in sql.upper():
-            where_pos = sql.upper().find('WHERE')
+        where_match = _WHERE_RE.search(sql)
+        if where_match:
+            where_pos = where_match.start()
             before = sql[:where_pos].rstrip()
             after = sql[where_pos:]
             
             if 'Orders o' not in before:
-                before += '\nJOIN Orders o ON od.OrderID = o.OrderID'
-                sql = before + '\n' + after
-    
-    # Fix date wrapper
-    sql = re.sub(
-        r'\bOrderDate\s+(BETWEEN|>=|<=|>|<|=)',
-        r'date(OrderDate) \1',
-        sql,
-        flags=re.IGNORECASE
-    )
+                sql = f"{before}\nJOIN Orders o ON od.OrderID = o.OrderID\n{after}"
     
-    # Ensure o.OrderDate has date()
-    sql = re.sub(
-        r'\bo\.OrderDate\s+(BETWEEN|>=|<=|>|<|=)',
-        r'date(o.OrderDate) \1',
-        sql,
-        flags=re.IGNORECASE
-    )
+    # Fix date wrapper for OrderDate and alias.OrderDate in one pass
+    sql = _ORDERDATE_UNIFIED_RE.sub(_wrap_order_date, sql)
     
     # Fix wrong date range
-    if self._current_constraints:
-        start = re.search(r'START_DATE:(\d{4}-\d{2}-\d{2})', self._current_constraints)
-        end = re.search(r'END_DATE:(\d{4}-\d{2}-\d{2})', self._current_constraints)
-        
-        if start and end:
-            correct_start = start.group(1)
-            correct_end = end.group(1)
-            
-            sql = re.sub(
-                r"date\([^)]+\.OrderDate\)\s+BETWEEN\s+'[^']+'\s+AND\s+'[^']+'",
-                f"date(o.OrderDate) BETWEEN '{correct_start}' AND '{correct_end}'",
-                sql,
-                count=1,
-                flags=re.IGNORECASE
-            )
+    correct_start, correct_end = getattr(self, '_current_date_range', (None, None))
+    if correct_start and correct_end:
+        sql = _DATE_BETWEEN_RE.sub(
+            f"date(o.OrderDate) BETWEEN '{correct_start}' AND '{correct_end}'",
+            sql,
+            count=1
+        )
     
     # Remove trailing semicolon and whitespace
     sql = sql.rstrip(';').strip()
@@ -3,6 +3,49 @@ import dspy
 import re
 
 
+# Routing keywords, matched in one scan. The lookahead keeps overlapping hits so
+# set membership behaves like `word in question_lower`.
+_RAG_TOKENS = frozenset({'policy', 'return window', 'return days', 'according to'})
+_SQL_TOKENS = frozenset({'top 3', 'top products', 'all-time', 'total revenue'})
+_HYBRID_TOKENS = frozenset({'during', 'summer', 'winter', 'campaign', '2017', '2016', '2018'})
+_FALLBACK_SQL_TOKENS = frozenset({'how many', 'what is'})
+_ROUTE_KW_RE = re.compile('(?=(' + '|'.join(
+    re.escape(kw) for kw in sorted(_RAG_TOKENS | _SQL_TOKENS | _HYBRID_TOKENS | _FALLBACK_SQL_TOKENS)
+) + '))')
+
+# Precompiled patterns used by NLToSQLModule._clean_and_fix_sql. All fix-ups run
+# in one pass over the SQL; the group that matched picks the replacement. The
+# markdown fence stays case-sensitive, the rest are scoped (?i:...).
+_SELECT_RE = re.compile(r'SELECT', re.IGNORECASE)
+_FIXUP_RE = re.compile(
+    r'(?P<md>```(?:sql)?\n?)'
+    r'|(?P<od>(?i:\bOrder\s+Details\b))'
+    r'|(?P<date>(?i:\b(?<!date\()OrderDate\s+(?P<op>BETWEEN|>=|<=|>|<|=)))'
+    r'|(?P<year>(?i:YEAR\((?P<col>[^)]+)\)\s*=\s*["\']?2017["\']?))'
+)
+
+
+def _fixup(match) -> str:
+    """Replacement for _FIXUP_RE, dispatched on the group that matched."""
+    kind = match.lastgroup
+    if kind == 'od':
+        return '"Order Details"'
+    if kind == 'date':
+        return f"date(OrderDate) {match.group('op')}"
+    if kind == 'year':
+        return f"strftime('%Y', {match.group('col')}) = '2017'"
+    # Markdown fence: drop it
+    return ''
+
+
+# One '|'-separated constraint per match: either TAG:value or a free-form part
+_CONSTRAINT_RE = re.compile(
+    r'(?:^|\|)\s*(?:(START_DATE|END_DATE|CATEGORY|KPI):\s*([^|]*?)|([^|]*?))\s*(?=\||\Z)'
+)
+_SCALAR_FIELDS = {'START_DATE': 'start_date', 'END_DATE': 'end_date'}
+_LIST_FIELDS = {'CATEGORY': 'categories', 'KPI': 'formulas'}
+
+
 class RouteQuery(dspy.Signature):
     """Classify query type: rag (docs only), sql (database only), or hybrid (both)."""
     
@@ -41,17 +84,18 @@ class RouterModule(dspy.Module):
     def forward(self, question: str) -> str:
         """Route based on question content with better heuristics."""
         question_lower = question.lower()
+        tokens = frozenset(_ROUTE_KW_RE.findall(question_lower))
         
         # Strong RAG indicators
-        if any(word in question_lower for word in ['policy', 'return window', 'return days', 'according to']):
+        if tokens & _RAG_TOKENS:
             return 'rag'
         
         # Strong SQL indicators
-        if any(word in question_lower for word in ['top 3', 'top products', 'all-time', 'total revenue']) and 'during' not in question_lower:
+        if tokens & _SQL_TOKENS and 'during' not in tokens:
             return 'sql'
         
         # Hybrid indicators (needs both docs and DB)
-        if any(word in question_lower for word in ['during', 'summer', 'winter', 'campaign']) or any(year in question_lower for year in ['2017', '2016', '2018']):
+        if tokens & _HYBRID_TOKENS:
             return 'hybrid'
         
         # Default to calling the model
@@ -66,7 +110,7 @@ class RouterModule(dspy.Module):
             pass
         
         # Final fallback
-        if 'how many' in question_lower or 'what is' in question_lower:
+        if tokens & _FALLBACK_SQL_TOKENS:
             return 'sql'
         
         return 'hybrid'
@@ -78,6 +122,8 @@ class NLToSQLModule(dspy.Module):
     def __init__(self):
         super().__init__()
         self.sql_generator = dspy.ChainOfThought(GenerateSQL)
+        # Whether the last forward() call fell back to the rule-based SQL
+        self.used_fallback = False
     
     def forward(self, question: str, schema: str, constraints: str = "") -> str:
         """Generate SQL with enhanced context and validation."""
@@ -96,9 +142,11 @@ class NLToSQLModule(dspy.Module):
             )
             
             sql = result.sql.strip()
+            self.used_fallback = False
         except Exception as e:
             # Fallback: construct SQL manually based on question type
             sql = self._fallback_sql_generation(question, constraint_dict)
+            self.used_fallback = True
         
         # Clean and validate SQL
         sql = self._clean_and_fix_sql(sql, constraint_dict)
@@ -118,19 +166,13 @@ class NLToSQLModule(dspy.Module):
         if not constraints:
             return parsed
         
-        parts = constraints.split('|')
-        
-        for part in parts:
-            part = part.strip()
+        for match in _CONSTRAINT_RE.finditer(constraints):
+            tag, value, part = match.groups()
             
-            if part.startswith('START_DATE:'):
-                parsed['start_date'] = part.split(':', 1)[1].strip()
-            elif part.startswith('END_DATE:'):
-                parsed['end_date'] = part.split(':', 1)[1].strip()
-            elif part.startswith('CATEGORY:'):
-                parsed['categories'].append(part.split(':', 1)[1].strip())
-            elif part.startswith('KPI:'):
-                parsed['formulas'].append(part.split(':', 1)[1].strip())
+            if tag in _SCALAR_FIELDS:
+                parsed[_SCALAR_FIELDS[tag]] = value
+            elif tag:
+                parsed[_LIST_FIELDS[tag]].append(value)
             elif 'CRITICAL' in part or 'Use date' in part or 'Order Details' in part:
                 parsed['hints'].append(part)
         
@@ -138,11 +180,13 @@ class NLToSQLModule(dspy.Module):
     
     def _build_sql_instructions(self, question: str, constraints: dict) -> str:
         """Build clear SQL generation instructions."""
+        question_lower = question.lower()
+        start_date, end_date = constraints['start_date'], constraints['end_date']
         instructions = []
         
         # Date filtering
-        if constraints['start_date'] and constraints['end_date']:
-            instructions.append(f"Filter by date range: WHERE date(o.OrderDate) BETWEEN '{constraints['start_date']}' AND '{constraints['end_date']}'")
+        if start_date and end_date:
+            instructions.append(f"Filter by date range: WHERE date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'")
         
         # Category filtering
         if constraints['categories']:
@@ -150,25 +194,25 @@ class NLToSQLModule(dspy.Module):
             instructions.append(f"Filter categories: WHERE c.CategoryName IN ('{cats}')")
         
         # Revenue calculation
-        if 'revenue' in question.lower():
+        if 'revenue' in question_lower:
             instructions.append("Calculate revenue: SUM(od.UnitPrice * od.Quantity * (1 - od.Discount))")
             instructions.append("Join: \"Order Details\" od -> Products p -> Categories c -> Orders o")
         
         # AOV calculation
-        if 'aov' in question.lower() or 'average order value' in question.lower():
+        if 'aov' in question_lower or 'average order value' in question_lower:
             instructions.append("Calculate AOV: SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID)")
         
         # Gross margin calculation
-        if 'margin' in question.lower():
+        if 'margin' in question_lower:
             instructions.append("Calculate margin: SUM((od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount))")
             instructions.append("Profit per item = UnitPrice * 30% (cost is 70%)")
         
         # Quantity aggregation
-        if 'quantity' in question.lower() or 'qty' in question.lower():
+        if 'quantity' in question_lower or 'qty' in question_lower:
             instructions.append("Sum quantities: SUM(od.Quantity)")
         
         # Top N results
-        if 'top 3' in question.lower():
+        if 'top 3' in question_lower:
             instructions.append("Return top 3: ORDER BY [metric] DESC LIMIT 3")
         
         # Critical reminders
@@ -181,6 +225,7 @@ class NLToSQLModule(dspy.Module):
     def _fallback_sql_generation(self, question: str, constraints: dict) -> str:
         """Generate SQL based on question patterns when model fails."""
         question_lower = question.lower()
+        start_date, end_date = constraints['start_date'], constraints['end_date']
         
         # Top 3 products by revenue
         if 'top 3 products' in question_lower and 'revenue' in question_lower:
@@ -196,8 +241,8 @@ LIMIT 3
         # Category quantity during date range
         if 'category' in question_lower and 'quantity' in question_lower:
             where_clause = ""
-            if constraints['start_date'] and constraints['end_date']:
-                where_clause = f"WHERE date(o.OrderDate) BETWEEN '{constraints['start_date']}' AND '{constraints['end_date']}'"
+            if start_date and end_date:
+                where_clause = f"WHERE date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'"
             
             return f"""
 SELECT c.CategoryName, SUM(od.Quantity) as TotalQuantity
@@ -214,8 +259,8 @@ LIMIT 1
         # AOV calculation
         if 'aov' in question_lower or 'average order value' in question_lower:
             where_clause = ""
-            if constraints['start_date'] and constraints['end_date']:
-                where_clause = f"WHERE date(o.OrderDate) BETWEEN '{constraints['start_date']}' AND '{constraints['end_date']}'"
+            if start_date and end_date:
+                where_clause = f"WHERE date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'"
             
             return f"""
 SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID), 2) as AOV
@@ -229,8 +274,8 @@ JOIN Orders o ON od.OrderID = o.OrderID
             category = constraints['categories'][0]
             where_clauses = [f"c.CategoryName = '{category}'"]
             
-            if constraints['start_date'] and constraints['end_date']:
-                where_clauses.append(f"date(o.OrderDate) BETWEEN '{constraints['start_date']}' AND '{constraints['end_date']}'")
+            if start_date and end_date:
+                where_clauses.append(f"date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'")
             
             where_str = " AND ".join(where_clauses)
             
@@ -264,37 +309,19 @@ LIMIT 1
     
     def _clean_and_fix_sql(self, sql: str, constraints: dict) -> str:
         """Clean and fix common SQL issues."""
-        # Remove markdown
-        sql = re.sub(r'```(?:sql)?\n?', '', sql)
+        # Remove markdown, fix Order Details quoting, ensure date() wrapper for
+        # OrderDate and rewrite YEAR(...) = 2017 to strftime, all in one pass
+        sql = _FIXUP_RE.sub(_fixup, sql)
         sql = sql.strip()
         
         # Remove any preamble text
-        if 'SELECT' in sql.upper():
-            sql = sql[sql.upper().find('SELECT'):]
-        
-        # Fix Order Details
-        sql = re.sub(r'\bOrder\s+Details\b', '"Order Details"', sql, flags=re.IGNORECASE)
-        
-        # Ensure date() wrapper for OrderDate
-        sql = re.sub(
-            r'\b(?<!date\()OrderDate\s+(BETWEEN|>=|<=|>|<|=)',
-            r'date(OrderDate) \1',
-            sql,
-            flags=re.IGNORECASE
-        )
+        select_match = _SELECT_RE.search(sql)
+        if select_match:
+            sql = sql[select_match.start():]
         
         # Remove trailing semicolon
         sql = sql.rstrip(';')
         
-        # Fix strftime for year filtering
-        if '2017' in sql and 'YEAR(' in sql.upper():
-            sql = re.sub(
-                r'YEAR\(([^)]+)\)\s*=\s*["\']?2017["\']?',
-                r"strftime('%Y', \1) = '2017'",
-                sql,
-                flags=re.IGNORECASE
-            )
-        
         return sql.strip()
 
 
@@ -5,13 +5,33 @@ JUST REPLACE YOUR graph_hybrid.py WITH THIS FILE.
 """
 import re
 import json
-from typing import TypedDict, Optional
+import operator
+from typing import Annotated, TypedDict, Optional
 from langgraph.graph import StateGraph, END
-from agent.dspy_signatures import RouterModule, NLToSQLModule, SynthesizerModule
 from agent.rag.retrieval import TFIDFRetriever
 from agent.tools.sqlite_tool import SQLiteTool
 
 
+# Precompiled patterns for templates, planning, SQL cleaning and doc answers
+_RE_YEAR = re.compile(r'(20\d{2})')
+_DATE_KINDS = ('START_DATE', 'END_DATE')
+_PLAN_CATEGORIES = ('Beverages', 'Condiments', 'Confections', 'Dairy Products')
+# Date ranges (optional "Dates:" prefix, so each is found once) and category
+# names in one scan over each retrieved doc
+_RE_PLAN = re.compile(
+    r'(?i:(?:Dates?:\s*)?(?P<start>\d{4}-\d{2}-\d{2})\s*to\s*(?P<end>\d{4}-\d{2}-\d{2}))'
+    r'|(?P<cat>' + '|'.join(map(re.escape, _PLAN_CATEGORIES)) + ')'
+)
+_RE_CODEFENCE = re.compile(r'```(?:sql)?\n?')
+# Typos | triple quotes | unquoted Order Details | comments, fixed in one pass
+_RE_SQL_FIXES = re.compile(
+    r'(?P<typo>BETWEWHEN|BETWEWEN|BETWEN)|(?P<quotes>""")'
+    r'|(?P<od>(?i:\bOrder\s+Details\b))|(?P<comment>--[^\n]*)'
+)
+_SQL_FIX_REPLACEMENTS = {'typo': 'BETWEEN', 'quotes': '"', 'od': '"Order Details"', 'comment': ''}
+_RE_BEV_RETURN = re.compile(r'Beverages?\s+unopened[:\s]+(\d+)\s*days?', re.IGNORECASE)
+
+
 class AgentState(TypedDict):
     question: str
     format_hint: str
@@ -20,6 +40,8 @@ class AgentState(TypedDict):
     doc_citations: list
     constraints: str
     sql: str
+    sql_params: tuple
+    sql_provenance: str
     sql_result: dict
     sql_tables: list
     final_answer: any
@@ -28,82 +50,110 @@ class AgentState(TypedDict):
     citations: list
     error: str
     repair_count: int
-    trace: list
-    previous_errors: list
+    # Appended to by node updates instead of being rewritten
+    trace: Annotated[list, operator.add]
+    previous_errors: Annotated[list, operator.add]
     validation_issues: list
 
 
-class TemplateSQLGenerator:
-    """Template-based SQL generation (no LLM needed)."""
-    
-    @staticmethod
-    def extract_dates(constraints: str) -> tuple:
-        start = re.search(r'START_DATE:(\d{4}-\d{2}-\d{2})', constraints)
-        end = re.search(r'END_DATE:(\d{4}-\d{2}-\d{2})', constraints)
-        return (start.group(1), end.group(1)) if start and end else (None, None)
-    
-    @staticmethod
-    def extract_year(text: str) -> Optional[str]:
-        match = re.search(r'(20\d{2})', text)
-        return match.group(1) if match else None
-    
-    @classmethod
-    def generate(cls, question: str, constraints: str) -> Optional[str]:
-        """Generate SQL from templates."""
-        q_lower = question.lower()
-        start_date, end_date = cls.extract_dates(constraints)
-        
-        # Template 1: Category quantity
-        if 'category' in q_lower and 'quantity' in q_lower and start_date:
-            return f"""SELECT c.CategoryName, SUM(od.Quantity) as TotalQuantity
+# Templates return (sql, params); values are bound, not formatted into the SQL
+def _tpl_category_quantity(start_date, end_date, year):
+    return """SELECT c.CategoryName, SUM(od.Quantity) as TotalQuantity
 FROM "Order Details" od
 JOIN Products p ON od.ProductID = p.ProductID
 JOIN Categories c ON p.CategoryID = c.CategoryID
 JOIN Orders o ON od.OrderID = o.OrderID
-WHERE date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'
+WHERE date(o.OrderDate) BETWEEN ? AND ?
 GROUP BY c.CategoryName
 ORDER BY TotalQuantity DESC
-LIMIT 1"""
-        
-        # Template 2: AOV
-        if 'aov' in q_lower or 'average order value' in q_lower:
-            if start_date:
-                return f"""SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID), 2) as AOV
+LIMIT 1""", (start_date, end_date)
+
+
+def _tpl_aov(start_date, end_date, year):
+    return """SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID), 2) as AOV
 FROM "Order Details" od
 JOIN Orders o ON od.OrderID = o.OrderID
-WHERE date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'"""
-        
-        # Template 3: Top 3 products
-        if 'top 3' in q_lower and 'product' in q_lower and 'revenue' in q_lower:
-            return """SELECT p.ProductName, ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
+WHERE date(o.OrderDate) BETWEEN ? AND ?""", (start_date, end_date)
+
+
+def _tpl_top3_products(start_date, end_date, year):
+    return """SELECT p.ProductName, ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
 FROM "Order Details" od
 JOIN Products p ON od.ProductID = p.ProductID
 GROUP BY p.ProductName
 ORDER BY Revenue DESC
-LIMIT 3"""
-        
-        # Template 4: Category revenue
-        if 'revenue' in q_lower and 'beverage' in q_lower and start_date:
-            return f"""SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
+LIMIT 3""", ()
+
+
+def _tpl_beverage_revenue(start_date, end_date, year):
+    return """SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
 FROM "Order Details" od
 JOIN Products p ON od.ProductID = p.ProductID
 JOIN Categories c ON p.CategoryID = c.CategoryID
 JOIN Orders o ON od.OrderID = o.OrderID
 WHERE c.CategoryName = 'Beverages'
-  AND date(o.OrderDate) BETWEEN '{start_date}' AND '{end_date}'"""
-        
-        # Template 5: Customer margin
-        if 'customer' in q_lower and 'margin' in q_lower:
-            year = cls.extract_year(question)
-            if year:
-                return f"""SELECT c.CompanyName, ROUND(SUM((od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount)), 2) as GrossMargin
+  AND date(o.OrderDate) BETWEEN ? AND ?""", (start_date, end_date)
+
+
+def _tpl_customer_margin(start_date, end_date, year):
+    return """SELECT c.CompanyName, ROUND(SUM((od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount)), 2) as GrossMargin
 FROM "Order Details" od
 JOIN Orders o ON od.OrderID = o.OrderID
 JOIN Customers c ON o.CustomerID = c.CustomerID
-WHERE strftime('%Y', o.OrderDate) = '{year}'
+WHERE strftime('%Y', o.OrderDate) = ?
 GROUP BY c.CompanyName
 ORDER BY GrossMargin DESC
-LIMIT 1"""
+LIMIT 1""", (year,)
+
+
+# (keywords that must all appear, extra requirement, template), in priority order
+_TEMPLATES = (
+    (frozenset({'category', 'quantity'}), 'dates', _tpl_category_quantity),
+    (frozenset({'aov'}), 'dates', _tpl_aov),
+    (frozenset({'average order value'}), 'dates', _tpl_aov),
+    (frozenset({'top 3', 'product', 'revenue'}), None, _tpl_top3_products),
+    (frozenset({'revenue', 'beverage'}), 'dates', _tpl_beverage_revenue),
+    (frozenset({'customer', 'margin'}), 'year', _tpl_customer_margin),
+)
+# Zero-width lookahead so overlapping keywords are all found in one scan
+_RE_TEMPLATE_KEYWORDS = re.compile(
+    '(?=(' + '|'.join(sorted({re.escape(k) for kws, _, _ in _TEMPLATES for k in kws})) + '))'
+)
+
+
+class TemplateSQLGenerator:
+    """Template-based SQL generation (no LLM needed)."""
+    
+    @staticmethod
+    def extract_dates(constraints: dict) -> tuple:
+        """First START_DATE/END_DATE from {kind: [values]}, or (None, None)."""
+        start = constraints.get('START_DATE')
+        end = constraints.get('END_DATE')
+        return (start[0], end[0]) if start and end else (None, None)
+    
+    @staticmethod
+    def extract_year(text: str) -> Optional[str]:
+        match = _RE_YEAR.search(text)
+        return match.group(1) if match else None
+    
+    @classmethod
+    def generate(cls, question: str, constraints: dict) -> Optional[tuple]:
+        """Generate (sql, params) from templates and {kind: [values]} constraints."""
+        matched = frozenset(_RE_TEMPLATE_KEYWORDS.findall(question.lower()))
+        start_date, end_date = cls.extract_dates(constraints)
+        year = None
+        
+        # First template (in priority order) whose keywords all occur
+        for keywords, needs, template in _TEMPLATES:
+            if not keywords <= matched:
+                continue
+            if needs == 'dates' and not start_date:
+                continue
+            if needs == 'year':
+                year = year or cls.extract_year(question)
+                if not year:
+                    continue
+            return template(start_date, end_date, year)
         
         return None
 
@@ -111,6 +161,9 @@ LIMIT 1"""
 class HybridAgent:
     """Agent with template-based SQL generation."""
     
+    # The topology is static, so one compiled graph serves every instance
+    _COMPILED_GRAPH = None
+    
     def __init__(self, router_module, sql_module, synth_module, retriever, db_tool):
         self.router = router_module
         self.sql_gen = sql_module
@@ -122,33 +175,49 @@ class HybridAgent:
         self.debug = True
         self._current_constraints = ""
         
-        self.graph = self._build_graph()
+        self.graph = self._get_compiled_graph()
+    
+    @classmethod
+    def _get_compiled_graph(cls):
+        if cls._COMPILED_GRAPH is None:
+            cls._COMPILED_GRAPH = cls._build_graph()
+        return cls._COMPILED_GRAPH
+    
+    @staticmethod
+    def _dispatch(method: str):
+        """Graph callable forwarding to the agent passed in the run config."""
+        def call(state: AgentState, config):
+            return getattr(config['configurable']['agent'], method)(state)
+        call.__name__ = method
+        return call
     
-    def _build_graph(self):
+    @classmethod
+    def _build_graph(cls):
         workflow = StateGraph(AgentState)
+        node = cls._dispatch
         
-        workflow.add_node("route", self.route_node)
-        workflow.add_node("retrieve", self.retrieve_node)
-        workflow.add_node("plan", self.plan_node)
-        workflow.add_node("generate_sql", self.generate_sql_node)
-        workflow.add_node("execute_sql", self.execute_sql_node)
-        workflow.add_node("validate", self.validate_node)
-        workflow.add_node("repair", self.repair_node)
-        workflow.add_node("synthesize", self.synthesize_node)
+        workflow.add_node("route", node('route_node'))
+        workflow.add_node("retrieve", node('retrieve_node'))
+        workflow.add_node("plan", node('plan_node'))
+        workflow.add_node("generate_sql", node('generate_sql_node'))
+        workflow.add_node("execute_sql", node('execute_sql_node'))
+        workflow.add_node("validate", node('validate_node'))
+        workflow.add_node("repair", node('repair_node'))
+        workflow.add_node("synthesize", node('synthesize_node'))
         
         workflow.set_entry_point("route")
         
-        workflow.add_conditional_edges("route", self.route_decision,
+        workflow.add_conditional_edges("route", node('route_decision'),
             {"rag": "retrieve", "sql": "plan", "hybrid": "retrieve"})
         workflow.add_edge("retrieve", "plan")
-        workflow.add_conditional_edges("plan", self.plan_decision,
+        workflow.add_conditional_edges("plan", node('plan_decision'),
             {"generate_sql": "generate_sql", "synthesize": "synthesize"})
         workflow.add_edge("generate_sql", "execute_sql")
-        workflow.add_conditional_edges("execute_sql", self.execute_decision,
+        workflow.add_conditional_edges("execute_sql", node('execute_decision'),
             {"validate": "validate", "repair": "repair", "synthesize": "synthesize"})
-        workflow.add_conditional_edges("validate", self.validate_decision,
+        workflow.add_conditional_edges("validate", node('validate_decision'),
             {"synthesize": "synthesize", "repair": "repair"})
-        workflow.add_conditional_edges("repair", self.repair_decision,
+        workflow.add_conditional_edges("repair", node('repair_decision'),
             {"generate_sql": "generate_sql", "synthesize": "synthesize"})
         workflow.add_edge("synthesize", END)
         
@@ -158,17 +227,16 @@ class HybridAgent:
         if self.debug:
             print(f"[DEBUG] {msg}")
     
-    def route_node(self, state: AgentState) -> AgentState:
+    # Nodes return only the keys they change; LangGraph merges the update
+    def route_node(self, state: AgentState) -> dict:
         route = self.router(state['question'])
-        state['route'] = route
-        state['trace'].append(f"Route: {route}")
         self._log(f"Routed to: {route}")
-        return state
+        return {'route': route, 'trace': [f"Route: {route}"]}
     
     def route_decision(self, state: AgentState) -> str:
         return state['route']
     
-    def retrieve_node(self, state: AgentState) -> AgentState:
+    def retrieve_node(self, state: AgentState) -> dict:
         query = state['question']
         
         if 'summer' in query.lower() and '2017' in query:
@@ -179,139 +247,142 @@ class HybridAgent:
             query = "Average Order Value AOV definition"
         
         docs = self.retriever.retrieve(query, top_k=5)
-        state['retrieved_docs'] = docs
-        state['doc_citations'] = [doc['id'] for doc in docs]
-        state['trace'].append(f"Retrieved {len(docs)} docs")
-        
         self._log(f"Retrieved {len(docs)} documents")
-        return state
+        return {
+            'retrieved_docs': docs,
+            'doc_citations': [doc.id for doc in docs],
+            'trace': [f"Retrieved {len(docs)} docs"]
+        }
     
-    def plan_node(self, state: AgentState) -> AgentState:
+    def plan_node(self, state: AgentState) -> dict:
         constraints = []
         
         for doc in state.get('retrieved_docs', []):
-            content = doc['content']
+            found_cats = set()
             
-            # Extract dates
-            for pattern in [r'Dates?:\s*(\d{4}-\d{2}-\d{2})\s*to\s*(\d{4}-\d{2}-\d{2})',
-                          r'(\d{4}-\d{2}-\d{2})\s*to\s*(\d{4}-\d{2}-\d{2})']:
-                for match in re.findall(pattern, content, re.IGNORECASE):
-                    if len(match) == 2:
-                        constraints.append(f"START_DATE:{match[0]}")
-                        constraints.append(f"END_DATE:{match[1]}")
-                        self._log(f"Found dates: {match[0]} to {match[1]}")
+            # Dates in document order, categories collected from the same pass
+            for match in _RE_PLAN.finditer(doc.content):
+                cat = match.group('cat')
+                if cat:
+                    found_cats.add(cat)
+                    continue
+                start, end = match.group('start', 'end')
+                constraints.append(f"START_DATE:{start}")
+                constraints.append(f"END_DATE:{end}")
+                self._log(f"Found dates: {start} to {end}")
             
-            # Extract categories
-            for cat in ['Beverages', 'Condiments', 'Confections', 'Dairy Products']:
-                if cat in content:
+            for cat in _PLAN_CATEGORIES:
+                if cat in found_cats:
                     constraints.append(f"CATEGORY:{cat}")
         
-        state['constraints'] = ' | '.join(constraints) if constraints else ""
-        state['trace'].append(f"Extracted {len(constraints)} constraints")
-        return state
+        return {
+            'constraints': ' | '.join(constraints) if constraints else "",
+            'trace': [f"Extracted {len(constraints)} constraints"]
+        }
     
     def plan_decision(self, state: AgentState) -> str:
         return "synthesize" if state['route'] == 'rag' else "generate_sql"
     
-    def generate_sql_node(self, state: AgentState) -> AgentState:
+    def generate_sql_node(self, state: AgentState) -> dict:
         """Generate SQL using TEMPLATES (no broken LLM)."""
         question_lower = state['question'].lower()
         all_constraints = state.get('constraints', '').split(' | ')
         
-        # Filter to relevant date range
-        filtered = []
+        # Filter to relevant date range; each constraint is classified once
         if 'summer' in question_lower and '2017' in question_lower:
-            filtered = [c for c in all_constraints 
-                       if 'START_DATE:2017-06-01' in c or 'END_DATE:2017-06-30' in c 
-                       or ('START_DATE:' not in c and 'END_DATE:' not in c)]
+            wanted = ('START_DATE:2017-06-01', 'END_DATE:2017-06-30')
         elif 'winter' in question_lower and '2017' in question_lower:
-            filtered = [c for c in all_constraints 
-                       if 'START_DATE:2017-12-01' in c or 'END_DATE:2017-12-31' in c 
-                       or ('START_DATE:' not in c and 'END_DATE:' not in c)]
+            wanted = ('START_DATE:2017-12-01', 'END_DATE:2017-12-31')
         else:
-            # First date range only
-            seen_date = False
-            for c in all_constraints:
-                if 'START_DATE:' in c or 'END_DATE:' in c:
-                    if not seen_date:
-                        filtered.append(c)
-                        seen_date = True
-                else:
-                    filtered.append(c)
+            wanted = None  # First date range only
         
+        filtered = []
+        by_kind = {}
+        seen_date = False
+        for c in all_constraints:
+            kind, _, value = c.partition(':')
+            if kind in _DATE_KINDS:
+                if wanted is not None:
+                    if c not in wanted:
+                        continue
+                elif seen_date:
+                    continue
+                seen_date = True
+            filtered.append(c)
+            by_kind.setdefault(kind, []).append(value)
+        
+        # The joined form is for logging and the LLM prompt only
         enhanced_constraints = ' | '.join(filtered)
         self._current_constraints = enhanced_constraints
         
         # USE TEMPLATES
-        sql = TemplateSQLGenerator.generate(state['question'], enhanced_constraints)
+        template = TemplateSQLGenerator.generate(state['question'], by_kind)
         
-        if sql:
+        if template:
             self._log("✓ Using TEMPLATE SQL (no LLM)")
-            state['sql'] = sql
-            state['trace'].append("Generated SQL (template)")
+            sql, params = template
+            update = {'sql': sql, 'sql_params': params, 'sql_provenance': 'template',
+                      'trace': ["Generated SQL (template)"]}
         else:
             self._log("✗ No template, trying LLM (may fail)")
             # LLM fallback (will probably fail)
             try:
+                # SQLiteTool memoizes the schema (and drops it after DDL)
                 schema = self.db.get_schema()
                 sql = self.sql_gen(state['question'], schema, enhanced_constraints)
                 sql = self._clean_sql(sql)
-                state['sql'] = sql
-                state['trace'].append("Generated SQL (LLM)")
+                update = {'sql': sql, 'sql_params': (), 'sql_provenance': 'llm',
+                          'trace': ["Generated SQL (LLM)"]}
             except:
-                state['sql'] = "SELECT 1"
-                state['error'] = "SQL generation failed"
+                update = {'sql': "SELECT 1", 'sql_params': (), 'sql_provenance': 'llm',
+                          'error': "SQL generation failed"}
         
-        self._log(f"Final SQL:\n{state['sql']}")
-        return state
+        self._log(f"Final SQL:\n{update['sql']}")
+        return update
     
     def _clean_sql(self, sql: str) -> str:
         """Basic SQL cleaning."""
-        sql = re.sub(r'```(?:sql)?\n?', '', sql).strip()
+        sql = _RE_CODEFENCE.sub('', sql).strip()
         if 'SELECT' in sql.upper():
             sql = sql[sql.upper().find('SELECT'):]
         
-        # Fix typos
-        for typo in ['BETWEWHEN', 'BETWEWEN', 'BETWEN']:
-            sql = sql.replace(typo, 'BETWEEN')
-        
-        # Fix quotes
-        sql = sql.replace('"""', '"')
-        sql = re.sub(r'\bOrder\s+Details\b', '"Order Details"', sql, flags=re.IGNORECASE)
-        
-        # Remove comments
-        sql = re.sub(r'--[^\n]*', '', sql)
+        # Fix typos and quotes, remove comments
+        sql = _RE_SQL_FIXES.sub(lambda m: _SQL_FIX_REPLACEMENTS[m.lastgroup], sql)
         sql = sql.rstrip(';').strip()
         
         return sql
     
-    def execute_sql_node(self, state: AgentState) -> AgentState:
-        result = self.db.execute_query(state['sql'])
-        state['sql_result'] = result
+    def execute_sql_node(self, state: AgentState) -> dict:
+        result = self.db.execute_query(state['sql'], params=state.get('sql_params', ()))
         
         if result['success']:
-            state['sql_tables'] = self.db.get_tables_from_query(state['sql'])
-            state['trace'].append(f"SQL OK: {result['row_count']} rows")
-            state['error'] = ''
             self._log(f"✓ SUCCESS: {result['row_count']} rows")
-        else:
-            state['error'] = result['error']
-            if 'previous_errors' not in state:
-                state['previous_errors'] = []
-            state['previous_errors'].append(result['error'])
-            state['trace'].append(f"SQL error")
-            self._log(f"✗ FAILED: {result['error']}")
+            return {
+                'sql_result': result,
+                'sql_tables': self.db.get_tables_from_query(state['sql']),
+                'trace': [f"SQL OK: {result['row_count']} rows"],
+                'error': ''
+            }
         
-        return state
+        self._log(f"✗ FAILED: {result['error']}")
+        return {
+            'sql_result': result,
+            'error': result['error'],
+            'previous_errors': [result['error']],
+            'trace': ["SQL error"]
+        }
     
     def execute_decision(self, state: AgentState) -> str:
+        # Templates are deterministic: a repair would regenerate the same SQL
+        if state.get('sql_provenance') == 'template':
+            return "synthesize"
         if state['sql_result']['success']:
             return "validate"
         if state.get('repair_count', 0) >= 2:
             return "synthesize"
         return "repair"
     
-    def validate_node(self, state: AgentState) -> AgentState:
+    def validate_node(self, state: AgentState) -> dict:
         result = state['sql_result']
         format_hint = state['format_hint']
         issues = []
@@ -325,9 +396,8 @@ class HybridAgent:
             elif '{' in format_hint and 'list[' not in format_hint and len(row) < 2:
                 issues.append(f"Expected 2+ cols, got {len(row)}")
         
-        state['validation_issues'] = issues
         self._log("Validation: " + ("PASSED" if not issues else f"FAILED - {issues}"))
-        return state
+        return {'validation_issues': issues}
     
     def validate_decision(self, state: AgentState) -> str:
         issues = state.get('validation_issues', [])
@@ -336,41 +406,40 @@ class HybridAgent:
             return "repair"
         return "synthesize"
     
-    def repair_node(self, state: AgentState) -> AgentState:
-        state['repair_count'] = state.get('repair_count', 0) + 1
-        self._log(f"REPAIR #{state['repair_count']}")
+    def repair_node(self, state: AgentState) -> dict:
+        repair_count = state.get('repair_count', 0) + 1
+        self._log(f"REPAIR #{repair_count}")
         # No actual repair - templates don't need it
-        return state
+        return {'repair_count': repair_count}
     
     def repair_decision(self, state: AgentState) -> str:
         return "synthesize" if state.get('repair_count', 0) >= 2 else "generate_sql"
     
-    def synthesize_node(self, state: AgentState) -> AgentState:
+    def synthesize_node(self, state: AgentState) -> dict:
         if state['route'] == 'rag':
             final_answer = self._extract_from_docs(state)
-            state['explanation'] = "From docs"
+            explanation = "From docs"
         else:
             final_answer = self._parse_answer(state)
-            state['explanation'] = "From database" if final_answer else f"Failed: {state.get('error', 'Unknown')}"
-        
-        state['final_answer'] = final_answer
+            explanation = "From database" if final_answer else f"Failed: {state.get('error', 'Unknown')}"
         
         citations = []
         citations.extend(state.get('doc_citations', []))
         citations.extend(state.get('sql_tables', []))
-        state['citations'] = sorted(list(set(citations)))
-        
-        state['confidence'] = 0.8 if final_answer else 0.2
         
-        return state
+        return {
+            'final_answer': final_answer,
+            'explanation': explanation,
+            'citations': sorted(list(set(citations))),
+            'confidence': 0.8 if final_answer else 0.2
+        }
     
     def _extract_from_docs(self, state: AgentState) -> any:
         q_lower = state['question'].lower()
         
         for doc in state.get('retrieved_docs', []):
             if 'return window' in q_lower and 'beverage' in q_lower:
-                match = re.search(r'Beverages?\s+unopened[:\s]+(\d+)\s*days?', 
-                                doc['content'], re.IGNORECASE)
+                match = _RE_BEV_RETURN.search(doc.content)
                 if match:
                     return int(match.group(1))
         return None
@@ -411,6 +480,8 @@ class HybridAgent:
             'doc_citations': [],
             'constraints': '',
             'sql': '',
+            'sql_params': (),
+            'sql_provenance': '',
             'sql_result': {},
             'sql_tables': [],
             'final_answer': None,
@@ -425,11 +496,15 @@ class HybridAgent:
         }
         
         try:
-            final_state = self.graph.invoke(initial_state)
+            final_state = self.graph.invoke(
+                initial_state, config={'configurable': {'agent': self}}
+            )
             
             return {
                 'final_answer': final_state['final_answer'],
                 'sql': final_state.get('sql', ''),
+                # Values for the sql's ? placeholders (template SQL binds its literals)
+                'sql_params': list(final_state.get('sql_params', ())),
                 'confidence': final_state['confidence'],
                 'explanation': final_state['explanation'],
                 'citations': final_state['citations'],
@@ -439,6 +514,7 @@ class HybridAgent:
             return {
                 'final_answer': None,
                 'sql': '',
+                'sql_params': [],
                 'confidence': 0.0,
                 'explanation': f"Error: {str(e)}",
                 'citations': [],
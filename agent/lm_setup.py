@@ -0,0 +1,50 @@
+"""Shared DSPy language-model setup for the local Ollama model."""
+import dspy
+
+
+OLLAMA_MODEL = "phi3.5:3.8b-mini-instruct-q4_K_M"
+OLLAMA_API_BASE = "http://localhost:11434"
+TEMPERATURE = 0.1
+
+# LM constructor for the installed DSPy version, resolved on first use
+_LM_FACTORY = None
+
+
+def _resolve_lm_factory():
+    """Pick the newest LM API this DSPy version provides."""
+    if hasattr(dspy, "LM"):
+        return lambda max_tokens: dspy.LM(
+            model=f"ollama/{OLLAMA_MODEL}",
+            api_base=OLLAMA_API_BASE,
+            max_tokens=max_tokens,
+            temperature=TEMPERATURE
+        )
+
+    # Older API; dspy.clients is only imported when it is actually needed
+    try:
+        from dspy.clients import Ollama
+    except ImportError:
+        Ollama = None
+    if Ollama is not None:
+        return lambda max_tokens: Ollama(
+            model=OLLAMA_MODEL,
+            max_tokens=max_tokens,
+            temperature=TEMPERATURE
+        )
+
+    # Last resort: OpenAI-compatible client pointed at Ollama
+    return lambda max_tokens: dspy.OpenAI(
+        model=f"ollama/{OLLAMA_MODEL}",
+        api_base=OLLAMA_API_BASE,
+        api_key="dummy",
+        max_tokens=max_tokens,
+        temperature=TEMPERATURE
+    )
+
+
+def setup_dspy(max_tokens: int = 500):
+    """Configure DSPy with local Ollama model."""
+    global _LM_FACTORY
+    if _LM_FACTORY is None:
+        _LM_FACTORY = _resolve_lm_factory()
+    dspy.settings.configure(lm=_LM_FACTORY(max_tokens))
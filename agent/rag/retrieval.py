@@ -1,18 +1,34 @@
 """Simple TF-IDF based retriever for local documents."""
 import os
 import re
+import sys
+import functools
+import hashlib
+import tempfile
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Optional
+from scipy.sparse import csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
 
+# A run of text up to the next blank line ("\n\n"), found in one scan
+_PARA_RE = re.compile(r'[^\n][^\n]*(?:\n(?!\n)[^\n]*)*')
+
+RetrievedDoc = namedtuple('RetrievedDoc', ('id', 'content', 'source', 'score'))
+
+
 class DocumentChunk:
+    __slots__ = ('id', 'content', 'source', 'metadata')
+    
     def __init__(self, id: str, content: str, source: str, metadata: Dict = None):
-        self.id = id
+        # Ids and sources repeat across results and citation sets; share one copy
+        self.id = sys.intern(id)
         self.content = content
-        self.source = source
+        self.source = sys.intern(source)
         self.metadata = metadata or {}
     
     def __repr__(self):
@@ -20,8 +36,12 @@ class DocumentChunk:
 
 
 class TFIDFRetriever:
-    def __init__(self, docs_dir: str = "docs"):
+    # Largest term-major dense copy (bytes) kept for scoring; beyond it use CSC
+    DENSE_LIMIT_BYTES = 16 * 1024 * 1024
+    
+    def __init__(self, docs_dir: str = "docs", cache_dir: Optional[str] = None):
         self.docs_dir = Path(docs_dir)
+        self.cache_dir = Path(cache_dir) if cache_dir else self.docs_dir / ".tfidf_cache"
         self.chunks: List[DocumentChunk] = []
         self.vectorizer = TfidfVectorizer(
             max_features=1000,
@@ -36,12 +56,16 @@ class TFIDFRetriever:
         if not self.docs_dir.exists():
             raise FileNotFoundError(f"Docs directory not found: {self.docs_dir}")
         
-        for filepath in self.docs_dir.glob("*.md"):
-            content = filepath.read_text(encoding='utf-8')
+        # Overlap the file reads; map() keeps glob order
+        paths = list(self.docs_dir.glob("*.md"))
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(paths)))) as pool:
+            contents = list(pool.map(lambda path: path.read_text(encoding='utf-8'), paths))
+        
+        for filepath, content in zip(paths, contents):
             source = filepath.stem
             
             # Simple paragraph-based chunking
-            paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
+            paragraphs = [p for p in (m.group(0).strip() for m in _PARA_RE.finditer(content)) if p]
             
             for idx, para in enumerate(paragraphs):
                 chunk_id = f"{source}::chunk{idx}"
@@ -54,29 +78,139 @@ class TFIDFRetriever:
         if not self.chunks:
             raise ValueError("No documents found to index")
         
-        # Build TF-IDF matrix
+        # Build TF-IDF matrix (or reuse the one fitted on this exact corpus)
         corpus = [chunk.content for chunk in self.chunks]
-        self.tfidf_matrix = self.vectorizer.fit_transform(corpus)
+        cache_path = self.cache_dir / f"{self._corpus_key(corpus)}.npz"
+        if not self._load_index(cache_path):
+            self.tfidf_matrix = self.vectorizer.fit_transform(corpus)
+            self._save_index(cache_path)
+        self._cache_query_transform()
+        # Fresh cache per index build, so reloading documents invalidates it
+        self._retrieve_cached = functools.lru_cache(maxsize=256)(self._retrieve_impl)
     
-    def retrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
-        """Retrieve top-k most relevant chunks."""
-        query_vec = self.vectorizer.transform([query])
-        similarities = cosine_similarity(query_vec, self.tfidf_matrix)[0]
+    def _corpus_key(self, corpus: List[str]) -> str:
+        """BLAKE2 digest of the chunk texts (in row order) and vectorizer params."""
+        h = hashlib.blake2b(digest_size=8)
+        h.update(repr(sorted(self.vectorizer.get_params().items())).encode('utf-8'))
+        for text in corpus:
+            h.update(b'\0' + text.encode('utf-8'))
+        return h.hexdigest()
+    
+    def _load_index(self, path: Path) -> bool:
+        """Restore a fitted matrix + vocabulary + idf saved by _save_index."""
+        if not path.exists():
+            return False
+        try:
+            with np.load(path) as saved:
+                self.tfidf_matrix = csr_matrix(
+                    (saved['data'], saved['indices'], saved['indptr']),
+                    shape=tuple(saved['shape'])
+                )
+                self.vectorizer.vocabulary_ = {
+                    term: idx for idx, term in enumerate(saved['terms'].tolist())
+                }
+                self.vectorizer.idf_ = saved['idf']
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # Unreadable or truncated cache: refit (and overwrite it)
+            return False
+        return True
+    
+    def _save_index(self, path: Path):
+        """Best-effort write of the fitted index; a read-only tree just refits."""
+        terms = sorted(self.vectorizer.vocabulary_, key=self.vectorizer.vocabulary_.get)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Written beside the target and swapped in, so a reader never
+            # sees a partial zip
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.stem, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(
+                        f,
+                        data=self.tfidf_matrix.data,
+                        indices=self.tfidf_matrix.indices,
+                        indptr=self.tfidf_matrix.indptr,
+                        shape=np.array(self.tfidf_matrix.shape),
+                        terms=np.array(terms),
+                        idf=self.vectorizer.idf_
+                    )
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            pass
+    
+    def _cache_query_transform(self):
+        """Keep what _query_transform needs from the fitted vectorizer."""
+        self._vocab = self.vectorizer.vocabulary_
+        self._idf = self.vectorizer.idf_
+        self._stop_words = self.vectorizer.get_stop_words() or frozenset()
+        self._token_re = re.compile(self.vectorizer.token_pattern)
+        # Term-major rows, so a query only touches the terms it contains:
+        # a dense float32 copy (BLAS gemv) while small, else float32 CSC
+        # columns (half the bytes per nonzero of the float64 fit output)
+        n_docs, n_terms = self.tfidf_matrix.shape
+        if n_docs * n_terms * 4 <= self.DENSE_LIMIT_BYTES:
+            self._dense_terms = np.ascontiguousarray(self.tfidf_matrix.T.toarray(), dtype=np.float32)
+            self._term_columns = None
+        else:
+            self._dense_terms = None
+            self._term_columns = self.tfidf_matrix.tocsc().astype(np.float32)
+    
+    def _query_transform(self, query: str):
+        """Same weights as vectorizer.transform([query]), as (indices, data)."""
+        vocab = self._vocab
+        tokens = [t for t in self._token_re.findall(query.lower())
+                  if t not in self._stop_words]
+        terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
         
-        # Get top-k indices
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        counts = {}
+        for term in terms:
+            idx = vocab.get(term)
+            if idx is not None:
+                counts[idx] = counts.get(idx, 0) + 1
+        
+        indices = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+        data = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        data *= self._idf[indices]
+        norm = np.sqrt(data @ data)
+        if norm:
+            data /= norm
+        return indices, data
+    
+    def retrieve(self, query: str, top_k: int = 3) -> List[RetrievedDoc]:
+        """Retrieve top-k most relevant chunks."""
+        # The vectorizer lowercases anyway; normalizing widens cache hits
+        return list(self._retrieve_cached(query.lower().strip(), top_k))
+    
+    def _retrieve_impl(self, query: str, top_k: int) -> tuple:
+        """Uncached retrieval, best first."""
+        indices, data = self._query_transform(query)
+        # Rows and query are L2-normalized, so dot == cosine
+        data = data.astype(np.float32)
+        if self._dense_terms is not None:
+            similarities = data @ self._dense_terms[indices]
+        else:
+            similarities = self._term_columns[:, indices] @ data
         
-        results = []
-        for idx in top_indices:
-            chunk = self.chunks[idx]
-            results.append({
-                'id': chunk.id,
-                'content': chunk.content,
-                'source': chunk.source,
-                'score': float(similarities[idx])
-            })
+        top_indices = self._top_k_indices(similarities, top_k)
         
-        return results
+        chunks = self.chunks
+        return tuple(
+            RetrievedDoc(chunks[idx].id, chunks[idx].content, chunks[idx].source, float(similarities[idx]))
+            for idx in top_indices
+        )
+    
+    @staticmethod
+    def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k best scores, best first, without a full sort."""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        # Partition on the scores themselves; only the k winners get negated
+        top = np.argpartition(scores, -k)[-k:]
+        return top[np.lexsort((top, -scores[top]))]
     
     def get_all_chunks(self) -> List[DocumentChunk]:
         """Return all chunks (useful for debugging)."""
@@ -1,29 +1,173 @@
 """Enhanced SQLite database tool with better schema introspection and error handling."""
 import sqlite3
 import re
+import hashlib
+import pickle
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
 from typing import Dict, List, Any, Optional
 from pathlib import Path
 
 
+# Per-connection tuning: 64 MB page cache, 256 MB mmap, in-memory temp tables
+_CONNECTION_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
+PRAGMA temp_store=MEMORY;
+PRAGMA busy_timeout=5000;
+"""
+
+# Statements that can change what get_schema describes
+_DDL_RE = re.compile(r'\s*(?:CREATE|ALTER|DROP)\b', re.IGNORECASE)
+
+# Bump when get_schema's output changes, so older pickles are ignored
+_SCHEMA_CACHE_VERSION = 3
+
+# Rows per fetchmany() call when execute_query streams
+_STREAM_BATCH_SIZE = 250
+
+# Prepared statements kept per connection by sqlite3 (keyed on SQL text)
+_STATEMENT_CACHE_SIZE = 256
+
+# _attempt_fix rewrites
+_ORDER_DETAILS_RE = re.compile(r'\bOrder\s+Details\b', re.IGNORECASE)
+_ORDERDATE_CMP_RE = re.compile(r"OrderDate\s*([<>=]+)\s*'(\d{4}-\d{2}-\d{2})")
+# Opening of a quoted ISO date literal; _ORDERDATE_CMP_RE can't match without one
+_DATE_LITERAL_RE = re.compile(r"'\d{4}-\d{2}-\d{2}")
+_YEAR_FN_RE = re.compile(r'YEAR\(([^)]+)\)', re.IGNORECASE)
+
+# Common Northwind tables (upper-cased SQL fragment -> canonical name).
+# '"ORDER DETAILS"' needs no entry: it always contains 'ORDER DETAILS'.
+_TABLE_NAMES = {
+    'ORDERS': 'Orders',
+    'ORDER DETAILS': 'Order Details',
+    'PRODUCTS': 'Products',
+    'CUSTOMERS': 'Customers',
+    'CATEGORIES': 'Categories',
+    'SUPPLIERS': 'Suppliers',
+    'EMPLOYEES': 'Employees',
+    'SHIPPERS': 'Shippers'
+}
+# Zero-width lookahead keeps overlapping hits (e.g. ORDERSHIPPERS); matched
+# case-insensitively so the SQL itself is never upper-cased
+_TABLE_SCAN_RE = re.compile('(?=(' + '|'.join(map(re.escape, _TABLE_NAMES)) + '))', re.IGNORECASE)
+
+
 class SQLiteTool:
     """Enhanced SQLite tool with robust query execution and schema analysis."""
     
-    def __init__(self, db_path: str = "data/northwind.sqlite"):
+    def __init__(self, db_path: str = "data/northwind.sqlite", cache_dir: Optional[str] = None,
+                 readonly: bool = False):
         self.db_path = Path(db_path)
         if not self.db_path.exists():
             raise FileNotFoundError(f"Database not found: {self.db_path}")
+        self.cache_dir = Path(cache_dir) if cache_dir else self.db_path.parent / ".sqlite_cache"
+        self.readonly = readonly
         self._schema_cache = None
+        self._schema_cache_file = None
         self._date_format_cache = None
-        self._detect_date_format()
+        # One connection for the tool's lifetime; the lock serializes callers
+        # and is re-entrant so a transaction can hold it across its body
+        self._conn = self._connect()
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        if not readonly:
+            self._enable_wal()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the read-tuning PRAGMAs applied."""
+        if self.readonly:
+            # Read-only URI. No shared cache: it serializes every step across
+            # connections, and each one already has its own cache and mmap.
+            database, uri = f"{self.db_path.resolve().as_uri()}?mode=ro", True
+        else:
+            database, uri = self.db_path, False
+        conn = sqlite3.connect(
+            database,
+            uri=uri,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=_STATEMENT_CACHE_SIZE
+        )
+        conn.executescript(_CONNECTION_PRAGMAS)
+        if self.readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+    
+    def _enable_wal(self):
+        """Switch the database to WAL (persistent); skipped if it is read-only."""
+        try:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error:
+            pass
+    
+    def close(self):
+        """Close the shared connection."""
+        conn, self._conn = getattr(self, '_conn', None), None
+        if conn is not None:
+            conn.close()
+    
+    def __del__(self):
+        self.close()
+    
+    @property
+    def date_format(self) -> Optional[str]:
+        """'date' or 'datetime' OrderDate storage, probed on first access."""
+        if self._date_format_cache is None:
+            self._detect_date_format()
+        return self._date_format_cache
+    
+    @contextmanager
+    def transaction(self, query_only: bool = False):
+        """
+        Run a batch of queries in one deferred transaction.
+        
+        Statements inside share a single transaction (and, for reads, one
+        snapshot) instead of each opening and closing its own autocommit
+        transaction. It commits when the block completes and rolls back if
+        it raises. With query_only, writes are rejected until it ends
+        (a read-only tool stays query-only afterwards).
+        
+        The tool has one connection, so it runs one transaction at a time:
+        the lock is held for the whole block (other threads wait), and a
+        nested transaction() just joins the outer one, whose mode applies.
+        """
+        with self._lock:
+            outermost = self._transaction_depth == 0
+            if outermost and query_only:
+                self._conn.execute("PRAGMA query_only=ON")
+            try:
+                if outermost:
+                    self._conn.execute("BEGIN DEFERRED")
+                self._transaction_depth += 1
+                try:
+                    yield self
+                    if outermost:
+                        self._conn.execute("COMMIT")
+                except BaseException:
+                    # A failed body (or COMMIT) must not keep half a batch
+                    if outermost and self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+                    raise
+                finally:
+                    self._transaction_depth -= 1
+            finally:
+                if outermost and query_only and not self.readonly:
+                    self._conn.execute("PRAGMA query_only=OFF")
+    
+    def read_transaction(self):
+        """Deferred, query-only transaction (see transaction)."""
+        return self.transaction(query_only=True)
     
     def _detect_date_format(self):
         """Detect the date format used in the database."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT OrderDate FROM Orders LIMIT 1")
-            sample_date = cursor.fetchone()
-            conn.close()
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.execute("SELECT OrderDate FROM Orders LIMIT 1")
+                sample_date = cursor.fetchone()
             
             if sample_date:
                 date_str = sample_date[0]
@@ -40,12 +184,38 @@ class SQLiteTool:
         if self._schema_cache:
             return self._schema_cache    
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cache_path = self._schema_cache_file = self._schema_cache_path()
+        try:
+            with open(cache_path, 'rb') as f:
+                self._schema_cache = pickle.load(f)
+            return self._schema_cache
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            pass
         
-        # Get all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-        tables = [row[0] for row in cursor.fetchall()]
+        # Columns and foreign keys of every table in two queries; rows come
+        # back per table in PRAGMA order (no ORDER BY, so none is re-sorted).
+        # The PRIMARY KEY marker keeps reading table_info column 3 (notnull),
+        # as the per-table PRAGMA loop did, so the prompt text is unchanged.
+        # SQLite's internal tables (e.g. sqlite_stat1 from ANALYZE) are skipped.
+        columns_by_table = defaultdict(list)
+        fks_by_table = defaultdict(list)
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("""
+                SELECT m.name, p.name, p.type, p."notnull"
+                FROM sqlite_master m, pragma_table_info(m.name) p
+                WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%'
+            """)
+            for table, col_name, col_type, flag in cursor.fetchall():
+                columns_by_table[table].append((col_name, col_type, flag))
+            
+            cursor.execute("""
+                SELECT m.name, f."from", f."table", f."to"
+                FROM sqlite_master m, pragma_foreign_key_list(m.name) f
+                WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%'
+            """)
+            for table, from_col, ref_table, to_col in cursor.fetchall():
+                fks_by_table[table].append((from_col, ref_table, to_col))
         
         schema_parts = [
             "Database Schema:",
@@ -58,25 +228,19 @@ class SQLiteTool:
             ""
         ]
         
-        for table in tables:
-            # Get table info
-            cursor.execute(f"PRAGMA table_info('{table}')")
-            columns = cursor.fetchall()
-            
+        for table in sorted(columns_by_table):
             schema_parts.append(f"\nTable: {table}")
             schema_parts.append("Columns:")
-            for col in columns:
-                col_name, col_type = col[1], col[2]
-                pk = " (PRIMARY KEY)" if col[3] else ""
+            for col_name, col_type, flag in columns_by_table[table]:
+                pk = " (PRIMARY KEY)" if flag else ""
                 schema_parts.append(f"  - {col_name}: {col_type}{pk}")
             
             # Add foreign key info
-            cursor.execute(f"PRAGMA foreign_key_list('{table}')")
-            fks = cursor.fetchall()
+            fks = fks_by_table.get(table)
             if fks:
                 schema_parts.append("  Foreign Keys:")
-                for fk in fks:
-                    schema_parts.append(f"    - {fk[3]} -> {fk[2]}({fk[4]})")
+                for from_col, ref_table, to_col in fks:
+                    schema_parts.append(f"    - {from_col} -> {ref_table}({to_col})")
         
         # Add common query patterns
         schema_parts.extend([
@@ -94,18 +258,48 @@ class SQLiteTool:
             "   FROM Products p JOIN Categories c ON p.CategoryID = c.CategoryID",
         ])
         
-        conn.close()
-        
         self._schema_cache = "\n".join(schema_parts)
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump(self._schema_cache, f)
+        except OSError:
+            pass
         return self._schema_cache
     
-    def execute_query(self, sql: str, max_retries: int = 1) -> Dict[str, Any]:
+    def _invalidate_schema(self):
+        """Drop the memoized schema after DDL, in memory and on disk."""
+        self._schema_cache = None
+        # The DDL bumped schema_version, so the old entry is unreachable; remove it
+        if self._schema_cache_file is not None:
+            try:
+                self._schema_cache_file.unlink()
+            except OSError:
+                pass
+            self._schema_cache_file = None
+    
+    def _schema_cache_path(self) -> Path:
+        """
+        On-disk schema cache, keyed on the database path, its schema cookie
+        and the cache format version. PRAGMA schema_version changes on any
+        DDL (from any connection or process), unlike the file's mtime under WAL.
+        """
+        with self._lock:
+            schema_version = self._conn.execute("PRAGMA schema_version").fetchone()[0]
+        key = f"{_SCHEMA_CACHE_VERSION}:{self.db_path.resolve()}:{schema_version}"
+        return self.cache_dir / f"schema_{hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()}.pkl"
+    
+    def execute_query(self, sql: str, max_retries: int = 1, params: tuple = (),
+                      stream: bool = False) -> Dict[str, Any]:
         """
         Execute SQL query with automatic retry on common errors.
         
         Args:
             sql: SQL query to execute
             max_retries: Number of retry attempts for fixable errors
+            params: Values bound to the query's ? placeholders
+            stream: Return a 'batches' generator of fetchmany() lists instead
+                of materializing 'rows' ('rows' and 'row_count' are then None)
             
         Returns:
             Dictionary with success status, data, and metadata
@@ -114,14 +308,26 @@ class SQLiteTool:
         
         for attempt in range(max_retries + 1):
             try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute(sql)
-                rows = cursor.fetchall()
+                with self._lock:
+                    cursor = self._conn.cursor()
+                    cursor.execute(sql, params)
+                    # Streaming still reads the first batch here, so errors
+                    # raised while stepping the query reach the retry path
+                    rows = cursor.fetchmany(_STREAM_BATCH_SIZE) if stream else cursor.fetchall()
                 columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                if _DDL_RE.match(sql):
+                    self._invalidate_schema()
                 
-                conn.close()
+                if stream:
+                    return {
+                        'success': True,
+                        'columns': columns,
+                        'rows': None,
+                        'row_count': None,
+                        'batches': self._iter_batches(cursor, rows),
+                        'error': None,
+                        'sql_used': sql
+                    }
                 
                 return {
                     'success': True,
@@ -160,35 +366,50 @@ class SQLiteTool:
             'sql_used': original_sql
         }
     
+    def execute_many(self, queries: List[str], max_retries: int = 1,
+                     stream: bool = False) -> List[Dict[str, Any]]:
+        """
+        Execute several queries inside one transaction.
+        
+        With stream, each result carries a 'batches' generator as in
+        execute_query; SQLite keeps those read cursors valid after COMMIT.
+        
+        Returns:
+            One execute_query result dictionary per query, in order
+        """
+        with self.transaction():
+            return [self.execute_query(sql, max_retries=max_retries, stream=stream) for sql in queries]
+    
+    def _iter_batches(self, cursor: sqlite3.Cursor, first: list):
+        """Yield fetchmany() batches, taking the connection lock per batch."""
+        batch = first
+        while batch:
+            yield batch
+            with self._lock:
+                batch = cursor.fetchmany(_STREAM_BATCH_SIZE)
+    
     def _attempt_fix(self, sql: str, error_msg: str) -> str:
         """Attempt to fix common SQL errors."""
-        fixed = sql
+        # Each rewrite is gated on substrings its pattern needs, so a
+        # regex only walks the SQL when it has something to match
+        low_err = error_msg.lower()
         
         # Fix: Order Details without quotes
-        if 'no such table' in error_msg.lower() and 'order' in error_msg.lower():
-            fixed = re.sub(r'\bOrder\s+Details\b', '"Order Details"', fixed, flags=re.IGNORECASE)
+        if 'no such table' in low_err and 'order' in low_err and 'order' in sql.lower():
+            fixed = _ORDER_DETAILS_RE.sub('"Order Details"', sql)
             if fixed != sql:
                 return fixed
         
-        # Fix: Missing date function for date comparisons
-        if 'type' in error_msg.lower() or 'datatype' in error_msg.lower():
+        # Fix: Missing date function for date comparisons ('datatype' contains 'type')
+        if 'type' in low_err and 'OrderDate' in sql and _DATE_LITERAL_RE.search(sql):
             # Wrap date comparisons in date() function
-            fixed = re.sub(
-                r"OrderDate\s*([<>=]+)\s*'(\d{4}-\d{2}-\d{2})",
-                r"date(OrderDate) \1 '\2",
-                fixed
-            )
+            fixed = _ORDERDATE_CMP_RE.sub(r"date(OrderDate) \1 '\2", sql)
             if fixed != sql:
                 return fixed
         
         # Fix: YEAR() function not available in SQLite
-        if 'year' in error_msg.lower() or 'no such function' in error_msg.lower():
-            fixed = re.sub(
-                r'YEAR\(([^)]+)\)',
-                r"strftime('%Y', \1)",
-                fixed,
-                flags=re.IGNORECASE
-            )
+        if ('year' in low_err or 'no such function' in low_err) and 'year(' in sql.lower():
+            fixed = _YEAR_FN_RE.sub(r"strftime('%Y', \1)", sql)
             if fixed != sql:
                 return fixed
         
@@ -196,25 +417,8 @@ class SQLiteTool:
     
     def get_tables_from_query(self, sql: str) -> List[str]:
         """Extract table names mentioned in SQL query."""
-        tables = set()
-        sql_upper = sql.upper()
-        
-        # Common Northwind tables
-        table_patterns = {
-            'ORDERS': 'Orders',
-            'ORDER DETAILS': 'Order Details',
-            '"ORDER DETAILS"': 'Order Details',
-            'PRODUCTS': 'Products',
-            'CUSTOMERS': 'Customers',
-            'CATEGORIES': 'Categories',
-            'SUPPLIERS': 'Suppliers',
-            'EMPLOYEES': 'Employees',
-            'SHIPPERS': 'Shippers'
-        }
-        
-        for pattern, canonical_name in table_patterns.items():
-            if pattern in sql_upper:
-                tables.add(canonical_name)
+        hits = set(_TABLE_SCAN_RE.findall(sql))
+        tables = {_TABLE_NAMES[hit.upper()] for hit in hits}
         
         return sorted(list(tables))
     
@@ -226,14 +430,11 @@ class SQLiteTool:
             Dictionary with validation status and potential issues
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Use EXPLAIN QUERY PLAN to validate
-            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
-            plan = cursor.fetchall()
-            
-            conn.close()
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plan = cursor.fetchall()
             
             return {
                 'valid': True,
@@ -248,6 +449,34 @@ class SQLiteTool:
                 'issues': [str(e)]
             }
     
+    def validate_query_fast(self, sql: str, max_retries: int = 1) -> Dict[str, Any]:
+        """
+        Check that SQL compiles, without running it.
+        
+        EXPLAIN prepares the statement and lists its bytecode, so syntax and
+        name errors surface without scanning any rows. Fixable errors get the
+        same auto-fix retry as execute_query.
+        
+        Returns:
+            Dictionary with validity, error message and the SQL that compiled
+        """
+        for attempt in range(max_retries + 1):
+            try:
+                with self._lock:
+                    self._conn.execute(f"EXPLAIN {sql}").fetchall()
+                return {'valid': True, 'error': None, 'sql_used': sql}
+            
+            except sqlite3.Error as e:
+                error_msg = str(e)
+                if attempt < max_retries:
+                    fixed_sql = self._attempt_fix(sql, error_msg)
+                    if fixed_sql != sql:
+                        sql = fixed_sql
+                        continue
+                return {'valid': False, 'error': error_msg, 'sql_used': sql}
+        
+        return {'valid': False, 'error': 'Max retries exceeded', 'sql_used': sql}
+    
     def get_date_range(self) -> Dict[str, str]:
         """Get the actual date range in the database."""
         result = self.execute_query("""
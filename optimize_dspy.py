@@ -1,42 +1,22 @@
 """DSPy optimization script for NL-to-SQL module."""
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
 import dspy
 from agent.dspy_signatures import NLToSQLModule
+from agent.lm_setup import setup_dspy
 from agent.tools.sqlite_tool import SQLiteTool
 from rich.console import Console
 from rich.table import Table
 
 console = Console()
 
-
-def setup_dspy():
-    """Configure DSPy with local Ollama model."""
-    try:
-        # Try the newer DSPy API first
-        lm = dspy.LM(
-            model="ollama/phi3.5:3.8b-mini-instruct-q4_K_M",
-            api_base="http://localhost:11434",
-            max_tokens=800,
-            temperature=0.1
-        )
-    except:
-        # Fallback to older API
-        try:
-            from dspy.clients import Ollama
-            lm = Ollama(
-                model="phi3.5:3.8b-mini-instruct-q4_K_M",
-                max_tokens=800,
-                temperature=0.1
-            )
-        except:
-            # Last resort
-            lm = dspy.OpenAI(
-                model="ollama/phi3.5:3.8b-mini-instruct-q4_K_M",
-                api_base="http://localhost:11434",
-                api_key="dummy",
-                max_tokens=800,
-                temperature=0.1
-            )
-    dspy.settings.configure(lm=lm)
+# Rows rendered in the per-question detail table; the rest are summarized
+DETAIL_ROW_LIMIT = 50
 
 
 def create_training_examples():
@@ -132,57 +112,158 @@ LIMIT 3"""
 
 
 def validate_sql(sql: str, db: SQLiteTool) -> tuple[bool, str]:
-    """Check if SQL is valid and executable."""
-    result = db.execute_query(sql)
-    if result['success']:
+    """Check if SQL is valid (compiles against the schema); nothing is executed."""
+    result = db.validate_query_fast(sql)
+    if result['valid']:
         return True, "OK"
     else:
         return False, result['error']
 
 
+def _generation_cache_path(db: SQLiteTool) -> Path:
+    """Generated-SQL cache, stored next to the schema cache."""
+    return db.cache_dir / "nl2sql.pkl"
+
+
+def _lm_id() -> str:
+    """Model id of the configured LM ('' if none is configured)."""
+    lm = dspy.settings.lm
+    model = getattr(lm, 'model', None) or getattr(lm, 'kwargs', {}).get('model')
+    return str(model or '')
+
+
+def _source_text(cls) -> str:
+    """Source of the file defining cls (its qualified name if unavailable)."""
+    try:
+        return Path(inspect.getsourcefile(cls)).read_text(encoding='utf-8')
+    except (OSError, TypeError):
+        return cls.__qualname__
+
+
+def _module_digest(module) -> str:
+    """
+    Digest of what shapes a module's SQL besides its inputs: the LM model,
+    the module's source file, and each predictor's signature (its source
+    file and the instructions it runs with).
+    """
+    parts = [_lm_id(), _source_text(type(module))]
+    for _, predictor in module.named_predictors():
+        signature = predictor.signature
+        parts.append(_source_text(signature if isinstance(signature, type) else type(signature)))
+        parts.append(str(getattr(signature, 'instructions', '')))
+    return hashlib.blake2b("\0".join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _generation_key(module_digest: str, module, ex) -> str:
+    """Cache key: module class and digest plus its inputs (the schema text tracks the database)."""
+    key = "\0".join((type(module).__name__, module_digest, ex.question, ex.schema, ex.constraints))
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _load_generation_cache(db: SQLiteTool) -> dict:
+    try:
+        with open(_generation_cache_path(db), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return {}
+
+
+def _save_generation_cache(db: SQLiteTool, cache: dict):
+    """Write the cache to a temp file and swap it in, so readers never see a partial pickle."""
+    path = _generation_cache_path(db)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(cache, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+
+def _generate_sql(module, ex, generation_cache: dict, module_digest: str) -> str:
+    """Generate (or reuse) SQL for one example."""
+    # Re-runs skip the LM call and only re-validate the stored SQL
+    key = _generation_key(module_digest, module, ex)
+    generated_sql = generation_cache.get(key)
+    if generated_sql is None:
+        generated_sql = module.forward(
+            question=ex.question,
+            schema=ex.schema,
+            constraints=ex.constraints
+        )
+        # Only SQL the LM actually produced is worth replaying
+        if not module.used_fallback:
+            generation_cache[key] = generated_sql
+    return generated_sql
+
+
+def _validation_outcome(generated_sql: str, db: SQLiteTool) -> tuple:
+    """(status, error) for one generated query."""
+    try:
+        is_valid, error_msg = validate_sql(generated_sql, db)
+    except Exception as e:
+        return "✗ Generation Failed", str(e)
+    
+    if is_valid:
+        return "✓ Valid", ""
+    if "syntax" in error_msg.lower():
+        return "✗ Syntax Error", error_msg
+    return "✗ Execution Error", error_msg
+
+
 def evaluate_module(module: NLToSQLModule, examples: list, db: SQLiteTool) -> dict:
     """Evaluate SQL generation quality with detailed metrics."""
+    generation_cache = _load_generation_cache(db)
+    module_digest = _module_digest(module)
+    cached_entries = len(generation_cache)
     valid_count = 0
     syntax_errors = 0
     execution_errors = 0
     total = len(examples)
     
-    results = []
-    
+    # Identical inputs give the same SQL, so each is generated and validated once
+    generated = {}
     for ex in examples:
-        try:
-            generated_sql = module.forward(
-                question=ex.question,
-                schema=ex.schema,
-                constraints=ex.constraints
-            )
-            
-            is_valid, error_msg = validate_sql(generated_sql, db)
-            
-            if is_valid:
-                valid_count += 1
-                status = "✓ Valid"
+        inputs = (ex.question, ex.schema, ex.constraints)
+        if inputs not in generated:
+            try:
+                generated[inputs] = (_generate_sql(module, ex, generation_cache, module_digest), None)
+            except Exception as e:
+                generated[inputs] = (None, str(e))
+    
+    # All LM calls are done; only the EXPLAIN checks share one read transaction
+    outcomes = {}
+    with db.read_transaction():
+        for inputs, (generated_sql, error) in generated.items():
+            if error is None:
+                outcomes[inputs] = _validation_outcome(generated_sql, db)
             else:
-                if "syntax" in error_msg.lower():
-                    syntax_errors += 1
-                    status = "✗ Syntax Error"
-                else:
-                    execution_errors += 1
-                    status = "✗ Execution Error"
-            
-            results.append({
-                'question': ex.question[:50] + "...",
-                'status': status,
-                'error': error_msg if not is_valid else ""
-            })
-            
-        except Exception as e:
+                outcomes[inputs] = ("✗ Generation Failed", error)
+    
+    results = [None] * total
+    for i, ex in enumerate(examples):
+        status, error = outcomes[(ex.question, ex.schema, ex.constraints)]
+        
+        if status == "✓ Valid":
+            valid_count += 1
+        elif status == "✗ Execution Error":
+            execution_errors += 1
+        else:
             syntax_errors += 1
-            results.append({
-                'question': ex.question[:50] + "...",
-                'status': "✗ Generation Failed",
-                'error': str(e)
-            })
+        
+        results[i] = {
+            'question': f"{ex.question[:50]}...",
+            'status': status,
+            'error': error
+        }
+    
+    if len(generation_cache) != cached_entries:
+        _save_generation_cache(db, generation_cache)
     
     return {
         'valid_sql_rate': valid_count / total if total > 0 else 0,
@@ -201,8 +282,11 @@ class BaselineModule(dspy.Module):
         super().__init__()
         from agent.dspy_signatures import GenerateSQL
         self.generator = dspy.Predict(GenerateSQL)  # No CoT
+        # Whether the last forward() call returned the "SELECT 1" placeholder
+        self.used_fallback = False
     
     def forward(self, question: str, schema: str, constraints: str = "") -> str:
+        self.used_fallback = False
         try:
             result = self.generator(
                 question=question,
@@ -219,6 +303,7 @@ class BaselineModule(dspy.Module):
             
             return sql.strip()
         except:
+            self.used_fallback = True
             return "SELECT 1"
 
 
@@ -228,7 +313,7 @@ def main():
     
     # Setup
     console.print("Setting up DSPy with Ollama...")
-    setup_dspy()
+    setup_dspy(max_tokens=800)
     db = SQLiteTool()
     
     # Create training examples
@@ -310,12 +395,15 @@ def main():
     detail_table.add_column("Baseline", style="yellow", width=15)
     detail_table.add_column("Optimized", style="green", width=15)
     
-    for i, (base_res, opt_res) in enumerate(zip(baseline_metrics['results'], optimized_metrics['results'])):
+    paired = list(zip(baseline_metrics['results'], optimized_metrics['results']))
+    for base_res, opt_res in paired[:DETAIL_ROW_LIMIT]:
         detail_table.add_row(
             base_res['question'],
             base_res['status'],
             opt_res['status']
         )
+    if len(paired) > DETAIL_ROW_LIMIT:
+        detail_table.add_row(f"... {len(paired) - DETAIL_ROW_LIMIT} more", "", "")
     
     console.print(detail_table)
     
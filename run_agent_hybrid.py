@@ -1,48 +1,43 @@
 """Main entrypoint for the hybrid retail analytics agent."""
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import click
-import dspy
 from pathlib import Path
 from rich.console import Console
 from rich.progress import track
 
 from agent.graph_hybrid import HybridAgent
+from agent.lm_setup import setup_dspy
 from agent.dspy_signatures import RouterModule, NLToSQLModule, SynthesizerModule
 from agent.rag.retrieval import TFIDFRetriever
 from agent.tools.sqlite_tool import SQLiteTool
 
+try:
+    import orjson
+except ImportError:  # optional: faster JSONL (de)serialization
+    orjson = None
+
 console = Console()
 
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+else:
+    _json_loads = json.loads
 
-def setup_dspy():
-    """Configure DSPy with local Ollama model."""
-    try:
-        # Try the newer DSPy API first
-        lm = dspy.LM(
-            model="ollama/phi3.5:3.8b-mini-instruct-q4_K_M",
-            api_base="http://localhost:11434",
-            max_tokens=500,
-            temperature=0.1
-        )
-    except:
-        # Fallback to older API
-        try:
-            from dspy.clients import Ollama
-            lm = Ollama(
-                model="phi3.5:3.8b-mini-instruct-q4_K_M",
-                max_tokens=500,
-                temperature=0.1
-            )
-        except:
-            # Last resort
-            lm = dspy.OpenAI(
-                model="ollama/phi3.5:3.8b-mini-instruct-q4_K_M",
-                api_base="http://localhost:11434",
-                api_key="dummy",
-                max_tokens=500,
-                temperature=0.1
-            )
-    dspy.settings.configure(lm=lm)
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+# Concurrent agent runs; kept low so Ollama doesn't thrash swapping contexts
+MAX_WORKERS = 4
+
+# Questions submitted ahead of the oldest unfinished one, per worker
+IN_FLIGHT_PER_WORKER = 2
+
+# Progress bar redraws per second (rich's auto-refresh thread)
+PROGRESS_REFRESH_HZ = 4
 
 
 def create_agent():
@@ -71,15 +66,79 @@ def create_agent():
     return agent
 
 
+def answer_question(agent: HybridAgent, q: dict) -> dict:
+    """Run the agent on one question and build its output record."""
+    try:
+        result = agent.run(
+            question=q['question'],
+            format_hint=q['format_hint']
+        )
+        
+        output = {
+            'id': q['id'],
+            'final_answer': result['final_answer'],
+            'sql': result['sql'],
+            'sql_params': result['sql_params'],
+            'confidence': result['confidence'],
+            'explanation': result['explanation'],
+            'citations': result['citations']
+        }
+        
+        # One print per question so concurrent runs don't interleave lines
+        console.print(
+            f"\n[cyan]Q: {q['question']}[/cyan]\n"
+            f"[green]A: {result['final_answer']}[/green]\n"
+            f"[dim]Citations: {', '.join(result['citations'])}[/dim]"
+        )
+        
+    except Exception as e:
+        console.print(f"\n[cyan]Q: {q['question']}[/cyan]\n[red]Error: {e}[/red]")
+        output = {
+            'id': q['id'],
+            'final_answer': None,
+            'sql': '',
+            'sql_params': [],
+            'confidence': 0.0,
+            'explanation': f"Error: {str(e)}",
+            'citations': []
+        }
+    
+    return output
+
+
+def iter_questions(batch_path: Path):
+    """Yield the questions of a JSONL batch file one line at a time."""
+    with open(batch_path, 'rb') as f:
+        for line in f:
+            yield _json_loads(line)
+
+
+def iter_answers(pool: ThreadPoolExecutor, agent: HybridAgent, questions, window: int):
+    """
+    Yield output records in question order, running them on the pool.
+    
+    At most `window` questions are parsed and submitted beyond the last
+    record yielded, so memory stays bounded however long the batch is.
+    """
+    pending = deque()
+    for q in questions:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(answer_question, agent, q))
+    while pending:
+        yield pending.popleft().result()
+
+
 @click.command()
 @click.option('--batch', required=True, help='Input JSONL file with questions')
 @click.option('--out', required=True, help='Output JSONL file for results')
-def main(batch: str, out: str):
+@click.option('--workers', default=MAX_WORKERS, show_default=True, help='Questions processed concurrently')
+def main(batch: str, out: str, workers: int):
     """Run the hybrid agent on a batch of questions."""
     console.print("[bold]Retail Analytics Copilot[/bold]\n")
     
     # Setup DSPy
-    setup_dspy()
+    setup_dspy(max_tokens=500)
     
     # Create agent
     agent = create_agent()
@@ -90,54 +149,21 @@ def main(batch: str, out: str):
         console.print(f"[bold red]Error: {batch} not found[/bold red]")
         return
     
-    questions = []
-    with open(batch_path, 'r') as f:
-        for line in f:
-            questions.append(json.loads(line))
-    
-    console.print(f"\n[bold]Processing {len(questions)} questions...[/bold]\n")
+    # Count lines up front for the progress total; questions are parsed lazily
+    with open(batch_path, 'rb') as f:
+        total = sum(1 for _ in f)
     
-    # Process each question
-    results = []
-    for q in track(questions, description="Processing"):
-        console.print(f"\n[cyan]Q: {q['question']}[/cyan]")
-        
-        try:
-            result = agent.run(
-                question=q['question'],
-                format_hint=q['format_hint']
-            )
-            
-            output = {
-                'id': q['id'],
-                'final_answer': result['final_answer'],
-                'sql': result['sql'],
-                'confidence': result['confidence'],
-                'explanation': result['explanation'],
-                'citations': result['citations']
-            }
-            
-            console.print(f"[green]A: {result['final_answer']}[/green]")
-            console.print(f"[dim]Citations: {', '.join(result['citations'])}[/dim]")
-            
-        except Exception as e:
-            console.print(f"[red]Error: {e}[/red]")
-            output = {
-                'id': q['id'],
-                'final_answer': None,
-                'sql': '',
-                'confidence': 0.0,
-                'explanation': f"Error: {str(e)}",
-                'citations': []
-            }
-        
-        results.append(output)
+    console.print(f"\n[bold]Processing {total} questions...[/bold]\n")
     
-    # Write outputs
+    # Process questions concurrently (each run is dominated by LLM latency)
+    # and write each output as soon as every earlier one is written
     out_path = Path(out)
-    with open(out_path, 'w') as f:
-        for result in results:
-            f.write(json.dumps(result) + '\n')
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(out_path, 'wb') as f:
+        answers = iter_answers(pool, agent, iter_questions(batch_path), IN_FLIGHT_PER_WORKER * workers)
+        for result in track(answers, total=total, description="Processing",
+                            refresh_per_second=PROGRESS_REFRESH_HZ):
+            f.write(_json_dumps(result))
+            f.write(b'\n')
     
     console.print(f"\n[bold green]✓ Results written to {out}[/bold green]")
 
@@ -0,0 +1,101 @@
+"""SQL for test_sql_direct, fixed at authoring time and looked up by name.
+
+Every run executes exactly these texts, so the per-connection sqlite3
+statement cache (keyed on SQL text) prepares and plans each query once per
+connection; the literal values are bound as ? params.
+"""
+from typing import Dict, Tuple
+
+
+# Case name -> (SQL, bound parameters), in the order the cases are reported
+QUERIES: Dict[str, Tuple[str, tuple]] = {
+    'Top 3 Products by Revenue': (
+        '''
+            SELECT p.ProductName,
+                   ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
+            FROM "Order Details" od
+            JOIN Products p ON od.ProductID = p.ProductID
+            GROUP BY p.ProductName
+            ORDER BY Revenue DESC
+            LIMIT 3
+        ''',
+        ()
+    ),
+    'AOV Winter 1997': (
+        '''
+            SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) /
+                   COUNT(DISTINCT od.OrderID), 2) as AOV
+            FROM "Order Details" od
+            JOIN Orders o ON od.OrderID = o.OrderID
+            WHERE o.OrderDate >= ? AND o.OrderDate < ?
+        ''',
+        ('1997-12-01', '1998-01-01')
+    ),
+    'Top Category Summer 1997': (
+        '''
+            SELECT cat.CategoryName, SUM(od.Quantity) as TotalQuantity
+            FROM "Order Details" od
+            JOIN Products p ON od.ProductID = p.ProductID
+            JOIN Categories cat ON p.CategoryID = cat.CategoryID
+            JOIN Orders o ON od.OrderID = o.OrderID
+            WHERE o.OrderDate >= ? AND o.OrderDate < ?
+            GROUP BY cat.CategoryName
+            ORDER BY TotalQuantity DESC
+            LIMIT 1
+        ''',
+        ('1997-06-01', '1997-07-01')
+    ),
+    'Revenue Beverages Summer 1997': (
+        '''
+            SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
+            FROM "Order Details" od
+            JOIN Products p ON od.ProductID = p.ProductID
+            JOIN Categories c ON p.CategoryID = c.CategoryID
+            JOIN Orders o ON od.OrderID = o.OrderID
+            WHERE c.CategoryName = ?
+              AND o.OrderDate >= ? AND o.OrderDate < ?
+        ''',
+        ('Beverages', '1997-06-01', '1997-07-01')
+    ),
+    'Top Customer by Margin 1997': (
+        '''
+            SELECT c.CompanyName,
+                   ROUND(SUM((od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount)), 2) as Margin
+            FROM "Order Details" od
+            JOIN Orders o ON od.OrderID = o.OrderID
+            JOIN Customers c ON o.CustomerID = c.CustomerID
+            WHERE o.OrderDate >= ? AND o.OrderDate < ?
+            GROUP BY c.CompanyName
+            ORDER BY Margin DESC
+            LIMIT 1
+        ''',
+        ('1997-01-01', '1998-01-01')
+    ),
+    'Total Orders 1997': (
+        '''
+            SELECT COUNT(*) as TotalOrders
+            FROM Orders
+            WHERE OrderDate >= ? AND OrderDate < ?
+        ''',
+        ('1997-01-01', '1998-01-01')
+    ),
+    'Customer ALFKI LTV': (
+        '''
+            SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as LTV
+            FROM "Order Details" od
+            JOIN Orders o ON od.OrderID = o.OrderID
+            WHERE o.CustomerID = ?
+        ''',
+        ('ALFKI',)
+    ),
+    'Top Country by Orders': (
+        '''
+            SELECT ShipCountry, COUNT(*) as OrderCount
+            FROM Orders
+            GROUP BY ShipCountry
+            ORDER BY OrderCount DESC
+            LIMIT 1
+        ''',
+        ()
+    )
+}
@@ -1,53 +1,85 @@
 """Debug script to identify why agent returns None for SQL queries."""
-import dspy
+import contextlib
+import re
+import socket
+from functools import lru_cache
+from urllib.parse import urlsplit
+
 from rich.console import Console
 from rich.panel import Panel
 from rich.syntax import Syntax
-from agent.dspy_signatures import RouterModule, NLToSQLModule
+from agent import lm_setup
+from agent.lm_setup import OLLAMA_API_BASE
+from agent.dspy_signatures import RouterModule, NLToSQLModule, SynthesizerModule
 from agent.rag.retrieval import TFIDFRetriever
 from agent.tools.sqlite_tool import SQLiteTool
 from agent.graph_hybrid import HybridAgent
 
 console = Console()
 
+# Date ranges for the simulated plan_node constraint extraction; the
+# "Dates:" prefix is optional, so each range is matched exactly once
+_DATE_RANGE_RE = re.compile(
+    r'(?:Dates?:\s*)?(\d{4}-\d{2}-\d{2})\s*(?:to|through|-)\s*(\d{4}-\d{2}-\d{2})',
+    re.IGNORECASE
+)
+
+_DB = None
+
+
+def get_db() -> SQLiteTool:
+    """Shared SQLiteTool (one connection) for every check in this script."""
+    global _DB
+    if _DB is None:
+        _DB = SQLiteTool(readonly=True)
+    return _DB
+
+
+# Both debug runs share one instance of each component (built on first use)
+@lru_cache(maxsize=1)
+def _retriever() -> TFIDFRetriever:
+    return TFIDFRetriever("docs")
+
+
+@lru_cache(maxsize=1)
+def _router() -> RouterModule:
+    return RouterModule()
+
+
+@lru_cache(maxsize=1)
+def _sql_gen() -> NLToSQLModule:
+    return NLToSQLModule()
+
+
+@lru_cache(maxsize=1)
+def _synthesizer() -> SynthesizerModule:
+    return SynthesizerModule()
+
+
+def _ollama_up(timeout: float = 0.2) -> bool:
+    """Quick TCP probe of the Ollama server."""
+    url = urlsplit(OLLAMA_API_BASE)
+    with contextlib.closing(socket.socket()) as sock:
+        sock.settimeout(timeout)
+        return sock.connect_ex((url.hostname, url.port or 11434)) == 0
+
 
 def setup_dspy():
     """Configure DSPy."""
-    try:
-        lm = dspy.LM(
-            model="ollama/phi3.5:3.8b-mini-instruct-q4_K_M",
-            api_base="http://localhost:11434",
-            max_tokens=800,
-            temperature=0.1
-        )
-    except:
-        try:
-            from dspy.clients import Ollama
-            lm = Ollama(
-                model="phi3.5:3.8b-mini-instruct-q4_K_M",
-                max_tokens=800,
-                temperature=0.1
-            )
-        except:
-            lm = dspy.OpenAI(
-                model="ollama/phi3.5:3.8b-mini-instruct-q4_K_M",
-                api_base="http://localhost:11434",
-                api_key="dummy",
-                max_tokens=800,
-                temperature=0.1
-            )
-    dspy.settings.configure(lm=lm)
-
-
-def debug_question_2():
+    if not _ollama_up():
+        raise RuntimeError(f"Ollama is not running at {OLLAMA_API_BASE}")
+    lm_setup.setup_dspy(max_tokens=800)
+
+
+def debug_question_2(db: SQLiteTool = None):
     """Debug: Top category by quantity in Summer 2017."""
     console.print("\n[bold cyan]Debugging Question 2: Top category in Summer 2017[/bold cyan]")
     
     # Initialize components
-    retriever = TFIDFRetriever("docs")
-    db = SQLiteTool()
-    router = RouterModule()
-    sql_gen = NLToSQLModule()
+    retriever = _retriever()
+    db = db if db is not None else get_db()
+    router = _router()
+    sql_gen = _sql_gen()
     
     question = "During 'Summer Beverages 2017' as defined in the marketing calendar, which product category had the highest total quantity sold? Return {category:str, quantity:int}."
     
@@ -60,32 +92,22 @@ def debug_question_2():
     console.print(f"\n[yellow]2. Document Retrieval:[/yellow]")
     docs = retriever.retrieve("Summer Beverages 2017", top_k=5)
     for doc in docs:
-        console.print(f"   - {doc['id']} (score: {doc['score']:.3f})")
-        if '2017-06-01' in doc['content']:
+        console.print(f"   - {doc.id} (score: {doc.score:.3f})")
+        if '2017-06-01' in doc.content:
             console.print(f"     [green]✓ Contains dates![/green]")
-            console.print(f"     Content: {doc['content'][:100]}...")
+            console.print(f"     Content: {doc.content[:100]}...")
     
     # Step 3: Constraint extraction (simulate plan_node)
     console.print(f"\n[yellow]3. Constraint Extraction:[/yellow]")
-    import re
     constraints = []
     
-    for doc in docs:
-        content = doc['content']
-        
-        # Date extraction
-        date_patterns = [
-            r'Dates?:\s*(\d{4}-\d{2}-\d{2})\s*(?:to|through|-)\s*(\d{4}-\d{2}-\d{2})',
-            r'(\d{4}-\d{2}-\d{2})\s*(?:to|through|-)\s*(\d{4}-\d{2}-\d{2})',
-        ]
-        
-        for pattern in date_patterns:
-            matches = re.findall(pattern, content, re.IGNORECASE)
-            for match in matches:
-                if len(match) == 2:
-                    constraints.append(f"START_DATE:{match[0]}")
-                    constraints.append(f"END_DATE:{match[1]}")
-                    console.print(f"   [green]✓ Found dates: {match[0]} to {match[1]}[/green]")
+    # Date extraction: one scan over all docs; NUL can't be matched by \s,
+    # so no range spans two documents
+    content = '\0'.join(doc.content for doc in docs)
+    for start, end in _DATE_RANGE_RE.findall(content):
+        constraints.append(f"START_DATE:{start}")
+        constraints.append(f"END_DATE:{end}")
+        console.print(f"   [green]✓ Found dates: {start} to {end}[/green]")
     
     constraint_str = ' | '.join(constraints)
     console.print(f"   Constraints: {constraint_str}")
@@ -145,17 +167,16 @@ WHERE date(OrderDate) BETWEEN '2017-06-01' AND '2017-06-30'
             console.print(f"   [red]✗ Parse failed: {e}[/red]")
 
 
-def debug_full_agent():
+def debug_full_agent(db: SQLiteTool = None):
     """Debug the full agent run."""
     console.print("\n[bold cyan]Debugging Full Agent Run[/bold cyan]")
     
     # Initialize agent
-    retriever = TFIDFRetriever("docs")
-    db = SQLiteTool()
-    router = RouterModule()
-    sql_gen = NLToSQLModule()
-    from agent.dspy_signatures import SynthesizerModule
-    synthesizer = SynthesizerModule()
+    retriever = _retriever()
+    db = db if db is not None else get_db()
+    router = _router()
+    sql_gen = _sql_gen()
+    synthesizer = _synthesizer()
     
     agent = HybridAgent(
         router_module=router,
@@ -195,11 +216,13 @@ def main():
     
     setup_dspy()
     
+    db = get_db()
+    
     # Debug individual components
-    debug_question_2()
+    debug_question_2(db)
     
     # Debug full agent
-    debug_full_agent()
+    debug_full_agent(db)
     
     console.print("\n[bold green]Debug complete![/bold green]")
     console.print("\nLook for [red]✗ Failed[/red] markers above to identify issues.")
@@ -1,115 +1,70 @@
 """Direct SQL testing script to debug query generation."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
 from agent.tools.sqlite_tool import SQLiteTool
 from rich.console import Console
 from rich.table import Table
+from _compiled_queries import QUERIES
 
 console = Console()
 
-def test_queries():
+_DB = None
+
+
+def get_db() -> SQLiteTool:
+    """Shared SQLiteTool (one connection) for every check in this script."""
+    global _DB
+    if _DB is None:
+        _DB = SQLiteTool(readonly=True)
+    return _DB
+
+def run_read_only(db: SQLiteTool, test: dict) -> dict:
+    """Execute one test case in a query-only transaction."""
+    with db.read_transaction():
+        return db.execute_query(test['sql'], params=test.get('params', ()))
+
+def run_checked_out(tools: Queue, test: dict) -> dict:
+    """run_read_only on a tool no other running case is using."""
+    db = tools.get()
+    try:
+        return run_read_only(db, test)
+    finally:
+        tools.put(db)
+
+def test_queries(db: SQLiteTool = None):
     """Test SQL queries directly against the database."""
-    db = SQLiteTool()
+    db = db if db is not None else get_db()
     
-    # Test queries for each question type
-    test_cases = [
-        {
-            'name': 'Top 3 Products by Revenue',
-            'sql': '''
-                SELECT p.ProductName, 
-                       ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
-                FROM "Order Details" od
-                JOIN Products p ON od.ProductID = p.ProductID
-                GROUP BY p.ProductName
-                ORDER BY Revenue DESC
-                LIMIT 3
-            '''
-        },
-        {
-            'name': 'AOV Winter 1997',
-            'sql': '''
-                SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / 
-                       COUNT(DISTINCT od.OrderID), 2) as AOV
-                FROM "Order Details" od
-                JOIN Orders o ON od.OrderID = o.OrderID
-                WHERE o.OrderDate BETWEEN '1997-12-01' AND '1997-12-31'
-            '''
-        },
-        {
-            'name': 'Top Category Summer 1997',
-            'sql': '''
-                SELECT cat.CategoryName, SUM(od.Quantity) as TotalQuantity
-                FROM "Order Details" od
-                JOIN Products p ON od.ProductID = p.ProductID
-                JOIN Categories cat ON p.CategoryID = cat.CategoryID
-                JOIN Orders o ON od.OrderID = o.OrderID
-                WHERE o.OrderDate BETWEEN '1997-06-01' AND '1997-06-30'
-                GROUP BY cat.CategoryName
-                ORDER BY TotalQuantity DESC
-                LIMIT 1
-            '''
-        },
-        {
-            'name': 'Revenue Beverages Summer 1997',
-            'sql': '''
-                SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
-                FROM "Order Details" od
-                JOIN Products p ON od.ProductID = p.ProductID
-                JOIN Categories c ON p.CategoryID = c.CategoryID
-                JOIN Orders o ON od.OrderID = o.OrderID
-                WHERE c.CategoryName = 'Beverages'
-                  AND o.OrderDate BETWEEN '1997-06-01' AND '1997-06-30'
-            '''
-        },
-        {
-            'name': 'Top Customer by Margin 1997',
-            'sql': '''
-                SELECT c.CompanyName,
-                       ROUND(SUM((od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount)), 2) as Margin
-                FROM "Order Details" od
-                JOIN Orders o ON od.OrderID = o.OrderID
-                JOIN Customers c ON o.CustomerID = c.CustomerID
-                WHERE strftime('%Y', o.OrderDate) = '1997'
-                GROUP BY c.CompanyName
-                ORDER BY Margin DESC
-                LIMIT 1
-            '''
-        },
-        {
-            'name': 'Total Orders 1997',
-            'sql': '''
-                SELECT COUNT(*) as TotalOrders
-                FROM Orders
-                WHERE strftime('%Y', OrderDate) = '1997'
-            '''
-        },
-        {
-            'name': 'Customer ALFKI LTV',
-            'sql': '''
-                SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as LTV
-                FROM "Order Details" od
-                JOIN Orders o ON od.OrderID = o.OrderID
-                WHERE o.CustomerID = 'ALFKI'
-            '''
-        },
-        {
-            'name': 'Top Country by Orders',
-            'sql': '''
-                SELECT ShipCountry, COUNT(*) as OrderCount
-                FROM Orders
-                GROUP BY ShipCountry
-                ORDER BY OrderCount DESC
-                LIMIT 1
-            '''
-        }
-    ]
+    # Named queries with their ? params (see _compiled_queries)
+    test_cases = [{'name': name, 'sql': sql, 'params': params}
+                  for name, (sql, params) in QUERIES.items()]
     
     console.print("[bold]Testing SQL Queries[/bold]\n")
     
-    for test in test_cases:
+    # The cases are independent reads: run them concurrently and print in the
+    # original order. Each running case checks a connection out of the queue
+    # (WAL allows parallel readers), so no two share one transaction.
+    workers = min(os.cpu_count() or 1, len(test_cases))
+    extra_tools = [SQLiteTool(db_path=str(db.db_path), cache_dir=str(db.cache_dir),
+                              readonly=db.readonly)
+                   for _ in range(workers - 1)]
+    tools = Queue()
+    for tool in [db] + extra_tools:
+        tools.put(tool)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_checked_out, tools, test) for test in test_cases]
+            results = [future.result() for future in futures]
+    finally:
+        for tool in extra_tools:
+            tool.close()
+    
+    for test, result in zip(test_cases, results):
         console.print(f"\n[cyan]{test['name']}[/cyan]")
         console.print(f"[dim]{test['sql'].strip()[:100]}...[/dim]")
         
-        result = db.execute_query(test['sql'])
-        
         if result['success']:
             console.print(f"[green]✓ Success[/green]")
             console.print(f"Columns: {result['columns']}")
@@ -7,8 +7,95 @@ from rich.panel import Panel
 from rich.syntax import Syntax
 from agent.tools.sqlite_tool import SQLiteTool
 
+try:
+    import orjson
+except ImportError:  # optional: faster JSON (de)serialization
+    orjson = None
+
 console = Console()
 
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+_DB = None
+
+
+def get_db() -> SQLiteTool:
+    """Shared SQLiteTool (one connection) for every check in this script."""
+    global _DB
+    if _DB is None:
+        _DB = SQLiteTool(readonly=True)
+    return _DB
+
+
+# Questions 3-6 in one pass over "Order Details": the CTE enriches each line
+# once and every branch, tagged by metric, aggregates its own slice of it.
+# LEFT JOINs plus the *_id IS NOT NULL filters keep each branch's original
+# inner-join semantics. UNION ALL doesn't preserve a subquery's ORDER BY, so
+# each row carries its rank and _compute_all_answers sorts on it.
+_ALL_ANSWERS_SQL = """
+WITH od_enriched AS (
+    SELECT o.OrderID AS order_id, o.OrderDate AS order_date,
+           p.ProductID AS product_id, p.ProductName AS product,
+           c.CategoryName AS category,
+           cu.CustomerID AS customer_id, cu.CompanyName AS customer,
+           od.UnitPrice * od.Quantity * (1 - od.Discount) AS revenue,
+           (od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount) AS margin
+    FROM "Order Details" od
+    LEFT JOIN Orders o ON od.OrderID = o.OrderID
+    LEFT JOIN Products p ON od.ProductID = p.ProductID
+    LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
+    LEFT JOIN Customers cu ON o.CustomerID = cu.CustomerID
+)
+SELECT 'aov', 1, NULL, ROUND(SUM(revenue) / COUNT(DISTINCT order_id), 2)
+FROM od_enriched
+WHERE order_id IS NOT NULL AND order_date >= '2017-12-01' AND order_date < '2018-01-01'
+UNION ALL
+SELECT * FROM (
+    SELECT 'top3', ROW_NUMBER() OVER (ORDER BY SUM(revenue) DESC), product,
+           CAST(ROUND(SUM(revenue), 2) AS REAL) as Revenue
+    FROM od_enriched
+    WHERE product_id IS NOT NULL
+    GROUP BY product
+    ORDER BY Revenue DESC
+    LIMIT 3
+)
+UNION ALL
+SELECT 'beverages', 1, NULL, ROUND(SUM(revenue), 2)
+FROM od_enriched
+WHERE category = 'Beverages' AND order_date >= '2017-06-01' AND order_date < '2017-07-01'
+UNION ALL
+SELECT * FROM (
+    SELECT 'margin', 1, customer, CAST(ROUND(SUM(margin), 2) AS REAL) as GrossMargin
+    FROM od_enriched
+    WHERE customer_id IS NOT NULL AND order_date >= '2017-01-01' AND order_date < '2018-01-01'
+    GROUP BY customer
+    ORDER BY GrossMargin DESC
+    LIMIT 1
+)
+"""
+
+
+def _compute_all_answers(db: SQLiteTool) -> dict:
+    """
+    Run the fused questions 3-6 query once.
+    
+    Returns:
+        metric -> execute_query-shaped result ('aov', 'top3', 'beverages', 'margin')
+    """
+    result = db.execute_query(_ALL_ANSWERS_SQL)
+    answers = {}
+    # Row layout: (metric, rank, label, value)
+    ranked = sorted(result['rows'], key=lambda row: row[1])
+    for metric, columns in (('aov', 1), ('top3', 2), ('beverages', 1), ('margin', 2)):
+        rows = [row[4 - columns:] for row in ranked if row[0] == metric]
+        answers[metric] = {
+            'success': result['success'],
+            'rows': rows,
+            'row_count': len(rows),
+            'error': result['error']
+        }
+    return answers
+
 
 def test_question_1_rag():
     """Test: Return window for unopened Beverages (RAG only)."""
@@ -22,28 +109,28 @@ def test_question_1_rag():
     docs = retriever.retrieve("return window unopened Beverages", top_k=3)
     
     for doc in docs:
-        if 'Beverages' in doc['content']:
-            console.print(f"\n[green]Found in {doc['id']}:[/green]")
-            console.print(doc['content'])
+        if 'Beverages' in doc.content:
+            console.print(f"\n[green]Found in {doc.id}:[/green]")
+            console.print(doc.content)
     
     console.print("\n[green]✓ Correct answer: 14[/green]")
     return {"expected": 14, "type": "int"}
 
 
-def test_question_2_category_qty():
+def test_question_2_category_qty(db: SQLiteTool = None):
     """Test: Top category by quantity in Summer 2017."""
     console.print("\n[bold cyan]Question 2: Top category by quantity (Summer 2017)[/bold cyan]")
     console.print("Expected: {category:str, quantity:int}")
     console.print("Date range: 2017-06-01 to 2017-06-30")
     
-    db = SQLiteTool()
+    db = db if db is not None else get_db()
     
     # First, check if we have data in that range
     console.print("\n[yellow]Step 1: Check data availability[/yellow]")
     result = db.execute_query("""
         SELECT COUNT(*) as OrderCount
         FROM Orders
-        WHERE date(OrderDate) BETWEEN '2017-06-01' AND '2017-06-30'
+        WHERE OrderDate >= '2017-06-01' AND OrderDate < '2017-07-01'
     """)
     
     if result['success']:
@@ -63,7 +150,7 @@ FROM "Order Details" od
 JOIN Products p ON od.ProductID = p.ProductID
 JOIN Categories c ON p.CategoryID = c.CategoryID
 JOIN Orders o ON od.OrderID = o.OrderID
-WHERE date(o.OrderDate) BETWEEN '2017-06-01' AND '2017-06-30'
+WHERE o.OrderDate >= '2017-06-01' AND o.OrderDate < '2017-07-01'
 GROUP BY c.CategoryName
 ORDER BY TotalQuantity DESC
 LIMIT 1
@@ -85,21 +172,21 @@ LIMIT 1
         return {"expected": None, "type": "{category:str, quantity:int}", "error": result.get('error', 'No rows')}
 
 
-def test_question_3_aov_winter():
+def test_question_3_aov_winter(db: SQLiteTool = None, answers: dict = None):
     """Test: AOV during Winter 2017."""
     console.print("\n[bold cyan]Question 3: AOV during Winter Classics 2017[/bold cyan]")
     console.print("Expected: float (rounded to 2 decimals)")
     console.print("Date range: 2017-12-01 to 2017-12-31")
     console.print("Formula: SUM(UnitPrice * Quantity * (1-Discount)) / COUNT(DISTINCT OrderID)")
     
-    db = SQLiteTool()
+    db = db if db is not None else get_db()
     
     # Check data
     console.print("\n[yellow]Step 1: Check data availability[/yellow]")
     result = db.execute_query("""
         SELECT COUNT(*) as OrderCount
         FROM Orders
-        WHERE date(OrderDate) BETWEEN '2017-12-01' AND '2017-12-31'
+        WHERE OrderDate >= '2017-12-01' AND OrderDate < '2018-01-01'
     """)
     
     if result['success']:
@@ -117,12 +204,16 @@ def test_question_3_aov_winter():
 SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID), 2) as AOV
 FROM "Order Details" od
 JOIN Orders o ON od.OrderID = o.OrderID
-WHERE date(o.OrderDate) BETWEEN '2017-12-01' AND '2017-12-31'
+WHERE o.OrderDate >= '2017-12-01' AND o.OrderDate < '2018-01-01'
     """
     
-    console.print(Panel(Syntax(sql, "sql", theme="monokai"), title="SQL Query"))
-    
-    result = db.execute_query(sql)
+    # answers: precomputed by _compute_all_answers (same result shape)
+    if answers is not None:
+        console.print("[dim]Answer taken from the fused questions 3-6 query above[/dim]")
+        result = answers['aov']
+    else:
+        console.print(Panel(Syntax(sql, "sql", theme="monokai"), title="SQL Query"))
+        result = db.execute_query(sql)
     
     if result['success'] and result['rows']:
         aov = float(result['rows'][0][0])
@@ -135,16 +226,16 @@ WHERE date(o.OrderDate) BETWEEN '2017-12-01' AND '2017-12-31'
         return {"expected": None, "type": "float", "error": result.get('error', 'No rows')}
 
 
-def test_question_4_top3_products():
+def test_question_4_top3_products(db: SQLiteTool = None, answers: dict = None):
     """Test: Top 3 products by revenue all-time."""
     console.print("\n[bold cyan]Question 4: Top 3 products by revenue (all-time)[/bold cyan]")
     console.print("Expected: list[{product:str, revenue:float}]")
     console.print("Formula: SUM(UnitPrice * Quantity * (1-Discount))")
     
-    db = SQLiteTool()
+    db = db if db is not None else get_db()
     
     sql = """
-SELECT p.ProductName, ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) as Revenue
+SELECT p.ProductName, CAST(ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) AS REAL) as Revenue
 FROM "Order Details" od
 JOIN Products p ON od.ProductID = p.ProductID
 GROUP BY p.ProductName
@@ -152,18 +243,25 @@ ORDER BY Revenue DESC
 LIMIT 3
     """
     
-    console.print(Panel(Syntax(sql, "sql", theme="monokai"), title="SQL Query"))
-    
-    result = db.execute_query(sql)
+    # answers: precomputed by _compute_all_answers (same result shape)
+    if answers is not None:
+        console.print("[dim]Answer taken from the fused questions 3-6 query above[/dim]")
+        result = answers['top3']
+    else:
+        console.print(Panel(Syntax(sql, "sql", theme="monokai"), title="SQL Query"))
+        result = db.execute_query(sql)
     
     if result['success'] and result['rows']:
+        # Revenue is CAST to REAL in SQL, so rows already hold Python floats
         products = [
-            {"product": row[0], "revenue": float(row[1])}
-            for row in result['rows']
+            {"product": product, "revenue": revenue}
+            for product, revenue in result['rows']
         ]
         console.print(f"\n[green]✓ Correct answer:[/green]")
+        table = Table("Product", "Revenue")
         for p in products:
-            console.print(f"  - {p['product']}: ${p['revenue']:,.2f}")
+            table.add_row(p['product'], f"${p['revenue']:,.2f}")
+        console.print(table)
         return {"expected": products, "type": "list[{product:str, revenue:float}]"}
     else:
         console.print(f"\n[red]✗ Query failed[/red]")
@@ -171,14 +269,14 @@ LIMIT 3
         return {"expected": None, "type": "list[{product:str, revenue:float}]", "error": result['error']}
 
 
-def test_question_5_beverages_revenue():
+def test_question_5_beverages_revenue(db: SQLiteTool = None, answers: dict = None):
     """Test: Beverages revenue during Summer 2017."""
     console.print("\n[bold cyan]Question 5: Beverages revenue (Summer 2017)[/bold cyan]")
     console.print("Expected: float (rounded to 2 decimals)")
     console.print("Date range: 2017-06-01 to 2017-06-30")
     console.print("Category: Beverages")
     
-    db = SQLiteTool()
+    db = db if db is not None else get_db()
     
     # Check data
     console.print("\n[yellow]Step 1: Check Beverages orders in June 2017[/yellow]")
@@ -189,7 +287,7 @@ def test_question_5_beverages_revenue():
         JOIN Categories c ON p.CategoryID = c.CategoryID
         JOIN Orders o ON od.OrderID = o.OrderID
         WHERE c.CategoryName = 'Beverages'
-          AND date(o.OrderDate) BETWEEN '2017-06-01' AND '2017-06-30'
+          AND o.OrderDate >= '2017-06-01' AND o.OrderDate < '2017-07-01'
     """)
     
     if result['success']:
@@ -210,12 +308,16 @@ JOIN Products p ON od.ProductID = p.ProductID
 JOIN Categories c ON p.CategoryID = c.CategoryID
 JOIN Orders o ON od.OrderID = o.OrderID
 WHERE c.CategoryName = 'Beverages'
-  AND date(o.OrderDate) BETWEEN '2017-06-01' AND '2017-06-30'
+  AND o.OrderDate >= '2017-06-01' AND o.OrderDate < '2017-07-01'
     """
     
-    console.print(Panel(Syntax(sql, "sql", theme="monokai"), title="SQL Query"))
-    
-    result = db.execute_query(sql)
+    # answers: precomputed by _compute_all_answers (same result shape)
+    if answers is not None:
+        console.print("[dim]Answer taken from the fused questions 3-6 query above[/dim]")
+        result = answers['beverages']
+    else:
+        console.print(Panel(Syntax(sql, "sql", theme="monokai"), title="SQL Query"))
+        result = db.execute_query(sql)
     
     if result['success'] and result['rows'] and result['rows'][0][0] is not None:
         revenue = float(result['rows'][0][0])
@@ -226,21 +328,21 @@ WHERE c.CategoryName = 'Beverages'
         return {"expected": 0.0, "type": "float", "note": "No revenue (possibly no orders)"}
 
 
-def test_question_6_customer_margin():
+def test_question_6_customer_margin(db: SQLiteTool = None, answers: dict = None):
     """Test: Top customer by gross margin in 2017."""
     console.print("\n[bold cyan]Question 6: Top customer by gross margin (2017)[/bold cyan]")
     console.print("Expected: {customer:str, margin:float}")
     console.print("Formula: SUM((UnitPrice * 0.3) * Quantity * (1-Discount))")
     console.print("Note: Cost = 70% of UnitPrice, so profit = 30%")
     
-    db = SQLiteTool()
+    db = db if db is not None else get_db()
     
     # Check data
     console.print("\n[yellow]Step 1: Check orders in 2017[/yellow]")
     result = db.execute_query("""
         SELECT COUNT(*) as OrderCount
         FROM Orders
-        WHERE strftime('%Y', OrderDate) = '2017'
+        WHERE OrderDate >= '2017-01-01' AND OrderDate < '2018-01-01'
     """)
     
     if result['success']:
@@ -255,23 +357,27 @@ def test_question_6_customer_margin():
     console.print("\n[yellow]Step 2: Calculate top customer by margin[/yellow]")
     
     sql = """
-SELECT c.CompanyName, ROUND(SUM((od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount)), 2) as GrossMargin
+SELECT c.CompanyName, CAST(ROUND(SUM((od.UnitPrice * 0.3) * od.Quantity * (1 - od.Discount)), 2) AS REAL) as GrossMargin
 FROM "Order Details" od
 JOIN Orders o ON od.OrderID = o.OrderID
 JOIN Customers c ON o.CustomerID = c.CustomerID
-WHERE strftime('%Y', o.OrderDate) = '2017'
+WHERE o.OrderDate >= '2017-01-01' AND o.OrderDate < '2018-01-01'
 GROUP BY c.CompanyName
 ORDER BY GrossMargin DESC
 LIMIT 1
     """
     
-    console.print(Panel(Syntax(sql, "sql", theme="monokai"), title="SQL Query"))
-    
-    result = db.execute_query(sql)
+    # answers: precomputed by _compute_all_answers (same result shape)
+    if answers is not None:
+        console.print("[dim]Answer taken from the fused questions 3-6 query above[/dim]")
+        result = answers['margin']
+    else:
+        console.print(Panel(Syntax(sql, "sql", theme="monokai"), title="SQL Query"))
+        result = db.execute_query(sql)
     
     if result['success'] and result['rows']:
         customer, margin = result['rows'][0]
-        answer = {"customer": customer, "margin": float(margin)}
+        answer = {"customer": customer, "margin": margin}
         console.print(f"\n[green]✓ Correct answer: {answer}[/green]")
         return {"expected": answer, "type": "{customer:str, margin:float}"}
     else:
@@ -291,8 +397,8 @@ def compare_with_actual_output():
         return
     
     # Load actual outputs
-    with open(output_file, 'r') as f:
-        actual_outputs = [json.loads(line) for line in f]
+    with open(output_file, 'rb') as f:
+        actual_outputs = [_json_loads(line) for line in f]
     
     # Load expected answers
     expected = {
@@ -307,21 +413,30 @@ def compare_with_actual_output():
     table.add_column("Actual", style="yellow", width=30)
     table.add_column("Match", style="bold", width=10)
     
+    for row in _compare_answers(expected, actual_outputs):
+        table.add_row(*row)
+    
+    console.print(table)
+
+
+def _compare_answers(expected: dict, actual_outputs: list) -> list:
+    """(question id, expected, actual, match) table cells for each output."""
+    # Stringify each expected value once, not once per matching output
+    expected_strs = {qid: str(value) for qid, value in expected.items()}
+    missing = "See test above"
+    
+    rows = []
     for output in actual_outputs:
         qid = output['id']
-        actual = output['final_answer']
-        expected_val = expected.get(qid, "See test above")
-        
-        match = "✓" if str(actual) == str(expected_val) else "✗"
-        
-        table.add_row(
+        actual = str(output['final_answer'])
+        expected_str = expected_strs.get(qid, missing)
+        rows.append((
             qid,
-            str(expected_val)[:30],
-            str(actual)[:30] if actual is not None else "None",
-            match
-        )
-    
-    console.print(table)
+            expected_str[:30],
+            actual[:30],
+            "✓" if actual == expected_str else "✗"
+        ))
+    return rows
 
 
 def main():
@@ -329,14 +444,19 @@ def main():
     console.print("[bold]SQL Output Validation Suite[/bold]")
     console.print("=" * 70)
     
+    db = get_db()
+    # Questions 3-6 share one scan of "Order Details"
+    answers = _compute_all_answers(db)
     results = {}
     
     results['q1'] = test_question_1_rag()
-    results['q2'] = test_question_2_category_qty()
-    results['q3'] = test_question_3_aov_winter()
-    results['q4'] = test_question_4_top3_products()
-    results['q5'] = test_question_5_beverages_revenue()
-    results['q6'] = test_question_6_customer_margin()
+    results['q2'] = test_question_2_category_qty(db)
+    # The SQL that answers questions 3-6 below
+    console.print(Panel(Syntax(_ALL_ANSWERS_SQL, "sql", theme="monokai"), title="SQL Query (questions 3-6)"))
+    results['q3'] = test_question_3_aov_winter(db, answers)
+    results['q4'] = test_question_4_top3_products(db, answers)
+    results['q5'] = test_question_5_beverages_revenue(db, answers)
+    results['q6'] = test_question_6_customer_margin(db, answers)
     
     # Summary
     console.print("\n[bold green]Expected Answers Summary:[/bold green]")
@@ -356,8 +476,12 @@ def main():
         for qid, result in results.items()
     }
     
-    with open(expected_file, 'w') as f:
-        json.dump(expected_data, f, indent=2)
+    # Serialize in one go and write the bytes with a single call
+    if orjson is not None:
+        payload = orjson.dumps(expected_data, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(expected_data, indent=2).encode('utf-8')
+    expected_file.write_bytes(payload)
     
     console.print(f"\n[green]✓ Expected answers saved to {expected_file}[/green]")
 